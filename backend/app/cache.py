@@ -0,0 +1,406 @@
+# app/cache.py
+# In-memory read-through caches with cross-worker invalidation.
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+
+from .db import engine, settings
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after ttl_seconds"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        # key -> when it was last deleted, for set_if_fresh; kept for ttl_seconds
+        self._deleted: "OrderedDict[Any, float]" = OrderedDict()
+        self._cleared_at = float("-inf")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def fill_token(self) -> float:
+        """Take before reading the source of a read-through fill; pass to set_if_fresh"""
+        return time.monotonic()
+
+    def set_if_fresh(self, key, value, token: float) -> bool:
+        """set(), unless key was deleted or the cache cleared since token was taken.
+
+        A fill that read the source before a concurrent invalidation would
+        otherwise store the old value for a full ttl_seconds.
+        """
+        if (
+            time.monotonic() - token > self.ttl_seconds
+            or token <= self._cleared_at
+            or token <= self._deleted.get(key, float("-inf"))
+        ):
+            return False
+        self.set(key, value)
+        return True
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+        now = time.monotonic()
+        self._deleted[key] = now
+        self._deleted.move_to_end(key)
+        # Older deletions can't matter: set_if_fresh rejects tokens that old
+        while next(iter(self._deleted.values())) < now - self.ttl_seconds:
+            self._deleted.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self._deleted.clear()
+        self._cleared_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskCache:
+    """JSON values in one file per key under a directory, expiring after ttl_seconds.
+
+    Keys must be filename-safe (e.g. hex digests). Survives restarts and is
+    shared by every worker on the host. Expired files are removed when read,
+    and every sweep_every writes a sweep also trims the directory to
+    max_entries, oldest writes first.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float, max_entries: int, sweep_every: int = 100):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.sweep_every = sweep_every
+        self._writes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry["expires_at"] < time.time():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write a uniquely named file next to the target, then rename, so
+        # readers never see a partial file and concurrent writers don't collide
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires_at": time.time() + self.ttl_seconds, "value": value}, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._writes += 1
+        if self._writes % self.sweep_every == 0:
+            self.sweep()
+
+    def sweep(self):
+        """Remove expired entries (and temp files left by a crash), then the oldest beyond max_entries"""
+        cutoff = time.time() - self.ttl_seconds
+        entries = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    mtime = entry.stat().st_mtime
+                    if mtime < cutoff:
+                        os.remove(entry.path)
+                    elif entry.name.endswith(".json"):
+                        entries.append((mtime, entry.path))
+                except FileNotFoundError:
+                    # Removed by another worker meanwhile
+                    pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class TieredCache:
+    """In-memory LRU in front of an optional on-disk tier; disk hits are promoted"""
+
+    def __init__(self, memory: TTLCache, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    async def get(self, key: str):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+class StaleWhileRevalidateCache:
+    """Async cache that serves stale values while one background task refreshes.
+
+    Fresh for ttl_seconds; after that the old value is still returned for up to
+    max_stale_seconds while a single refresh per key runs. Concurrent misses share
+    one load, so load on the source stays flat however many callers poll.
+    """
+
+    def __init__(self, ttl_seconds: float, max_stale_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self._entries: Dict[Any, tuple] = {}
+        self._loading: Dict[Any, asyncio.Task] = {}
+
+    def _load(self, key, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._loading.get(key)
+        if task is None:
+            async def run():
+                try:
+                    value = await loader()
+                    self._entries[key] = (time.monotonic(), value)
+                    return value
+                finally:
+                    self._loading.pop(key, None)
+            task = asyncio.create_task(run())
+            task.add_done_callback(self._log_failure)
+            self._loading[key] = task
+        return task
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        # Background refreshes have no awaiting caller; keep serving stale and log
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Cache refresh error: {str(task.exception())}")
+
+    async def get(self, key, loader: Callable[[], Awaitable[Any]]):
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl_seconds:
+                return entry[1]
+            if age < self.ttl_seconds + self.max_stale_seconds:
+                self._load(key, loader)
+                return entry[1]
+        # Nothing usable: wait on the (shared) load; shield it so one
+        # cancelled request doesn't abort the load for everyone else
+        return await asyncio.shield(self._load(key, loader))
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+# Invalidation backends
+# A backend delivers (channel, key) messages to every worker, including the sender.
+
+MessageHandler = Callable[[str, str], None]
+
+class InProcessInvalidation:
+    """Default backend: delivers messages within this process only"""
+
+    def __init__(self):
+        self._handlers: Dict[str, list] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self._handlers.clear()
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, handler: Callable[[], None]):
+        # Never disconnected, never misses a message
+        pass
+
+    async def publish(self, channel: str, key: str):
+        for handler in self._handlers.get(channel, []):
+            handler(channel, key)
+
+    async def publish_many(self, channel: str, keys: List[str]):
+        for key in keys:
+            await self.publish(channel, key)
+
+class PostgresInvalidation:
+    """LISTEN/NOTIFY backend so every worker sees every invalidation.
+
+    Holds one dedicated asyncpg connection for LISTEN and reopens it if it
+    drops. Notifications sent while it was down are lost, so on_reconnect
+    handlers run once it is back to drop whatever may have gone stale.
+    Publishing goes through the engine's pool, never the listener connection.
+    LISTEN does not work through PgBouncer in transaction mode, so point
+    CACHE_PUBSUB_DSN directly at the application's database.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._conn = None
+        self._handlers: Dict[str, list] = {}
+        self._reconnect_handlers: list = []
+        self._reconnecting: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    async def start(self):
+        self._stopped = False
+        await self._connect()
+
+    async def stop(self):
+        self._stopped = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _connect(self):
+        import asyncpg
+        conn = await asyncpg.connect(self.dsn)
+        conn.add_termination_listener(self._on_lost)
+        self._conn = conn
+        for channel in list(self._handlers):
+            await conn.add_listener(channel, self._dispatch)
+
+    def _on_lost(self, connection):
+        if connection is self._conn and not self._stopped and self._reconnecting is None:
+            self._conn = None
+            self._reconnecting = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1.0
+        try:
+            while not self._stopped:
+                try:
+                    await self._connect()
+                except Exception as e:
+                    print(f"Cache invalidation reconnect error: {str(e)}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30.0)
+                    continue
+                for handler in self._reconnect_handlers:
+                    handler()
+                return
+        finally:
+            self._reconnecting = None
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        if channel not in self._handlers:
+            self._handlers[channel] = []
+            if self._conn is not None:
+                await self._conn.add_listener(channel, self._dispatch)
+        self._handlers[channel].append(handler)
+
+    def on_reconnect(self, handler: Callable[[], None]):
+        self._reconnect_handlers.append(handler)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        for handler in self._handlers.get(channel, []):
+            handler(channel, payload)
+
+    async def publish(self, channel: str, key: str):
+        # A pooled connection: asyncpg allows one operation at a time per
+        # connection, and the listener's is busy receiving
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("SELECT pg_notify(:channel, :key)"), {"channel": channel, "key": key}
+            )
+
+    async def publish_many(self, channel: str, keys: List[str]):
+        # One statement (one round trip) however many messages
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("SELECT pg_notify(:channel, k) FROM unnest(CAST(:keys AS text[])) k"),
+                {"channel": channel, "keys": keys},
+            )
+
+def _make_backend():
+    if settings.CACHE_PUBSUB_BACKEND == "postgres":
+        dsn = settings.CACHE_PUBSUB_DSN or (
+            f"postgresql://{settings.DB_USER}:{settings.DB_PASSWORD}"
+            f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
+        )
+        return PostgresInvalidation(dsn)
+    return InProcessInvalidation()
+
+invalidation = _make_backend()
+
+# Account profile cache: account id -> serialized AccountResponse JSON bytes
+ACCOUNT_CHANNEL = "account_cache"
+
+account_cache = TTLCache(
+    max_entries=settings.ACCOUNT_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ACCOUNT_CACHE_TTL_SECONDS,
+)
+
+# NOTIFY payloads must stay under 8000 bytes; bulk invalidations pack
+# comma-separated ids (37 bytes each) into messages of at most this size
+ACCOUNT_MESSAGE_BYTES = 7900
+
+def _on_account_invalidated(channel: str, key: str):
+    for account_id in key.split(","):
+        account_cache.delete(uuid.UUID(account_id))
+
+async def start_cache():
+    await invalidation.start()
+    await invalidation.subscribe(ACCOUNT_CHANNEL, _on_account_invalidated)
+    # Invalidations missed while disconnected can't be replayed
+    invalidation.on_reconnect(account_cache.clear)
+
+async def stop_cache():
+    await invalidation.stop()
+
+async def invalidate_account(account_id: uuid.UUID):
+    # Drop locally right away, then tell the other workers
+    account_cache.delete(account_id)
+    await invalidation.publish(ACCOUNT_CHANNEL, str(account_id))
+
+async def invalidate_accounts(account_ids: Iterable[uuid.UUID]):
+    """invalidate_account for many ids, published in as few messages as fit"""
+    keys = []
+    for account_id in account_ids:
+        account_cache.delete(account_id)
+        keys.append(str(account_id))
+    if not keys:
+        return
+    per_message = ACCOUNT_MESSAGE_BYTES // 37
+    await invalidation.publish_many(
+        ACCOUNT_CHANNEL, [",".join(keys[i:i + per_message]) for i in range(0, len(keys), per_message)]
+    )
@@ -0,0 +1,104 @@
+# app/changefeed.py
+# Ordered, resumable feed of account changes read from the account_changes outbox.
+#
+# Offsets are "<txid>.<id>" strings. Rows are read in (txid, id) order and only
+# below the oldest still-running transaction, so a slow writer can never commit
+# a row behind an offset a reader has already passed.
+import asyncio
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, text, tuple_
+
+from .db import SessionLocal, settings
+from .models import AccountChange
+from .jobs import load_checkpoint, save_checkpoint
+from .cache import invalidation
+
+START = "0.0"
+CHANNEL = "account_changes"
+
+def parse_offset(offset: Optional[str]) -> Tuple[int, int]:
+    txid, _, change_id = (offset or START).partition(".")
+    return int(txid), int(change_id or 0)
+
+def format_offset(change: AccountChange) -> str:
+    return f"{change.txid}.{change.id}"
+
+def to_event(change: AccountChange) -> dict:
+    return {
+        "offset": format_offset(change),
+        "op": change.op,
+        "account_id": str(change.account_id),
+        "tenant_id": str(change.tenant_id),
+        "version": change.version,
+        "changed_at": change.changed_at.isoformat(),
+    }
+
+async def read_changes(
+    session, after: Optional[str], limit: int, tenant_id: Optional[uuid.UUID] = None
+) -> List[dict]:
+    """Committed changes after the given offset, oldest first"""
+    query = select(AccountChange).where(
+        tuple_(AccountChange.txid, AccountChange.id) > tuple_(*parse_offset(after)),
+        AccountChange.txid < text("txid_snapshot_xmin(txid_current_snapshot())"),
+    ).order_by(AccountChange.txid, AccountChange.id).limit(limit)
+    if tenant_id is not None:
+        query = query.where(AccountChange.tenant_id == tenant_id)
+    result = await session.execute(query)
+    return [to_event(change) for change in result.scalars().all()]
+
+# Wake-ups: the accounts trigger NOTIFYs on every commit. With the postgres
+# pub/sub backend readers wake immediately; otherwise they fall back to polling.
+_new_changes = asyncio.Event()
+
+def _on_notify(channel: str, payload: str):
+    global _new_changes
+    _new_changes.set()
+    _new_changes = asyncio.Event()
+
+async def wait_for_changes(timeout: float):
+    event = _new_changes
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+# In-process subscribers
+
+ChangeHandler = Callable[[List[dict]], Awaitable[None]]
+
+_subscribers: Dict[str, ChangeHandler] = {}
+
+def subscribe(name: str, handler: ChangeHandler):
+    """Register a handler that receives batches of events in order.
+
+    Each subscriber keeps its own offset in job_checkpoints, saved after the
+    handler returns, so delivery is at-least-once and survives restarts.
+    """
+    _subscribers[name] = handler
+
+async def _consume(name: str, handler: ChangeHandler):
+    checkpoint = f"changefeed:{name}"
+    async with SessionLocal() as session:
+        offset = await load_checkpoint(session, checkpoint)
+    while True:
+        try:
+            async with SessionLocal() as session:
+                events = await read_changes(session, offset, settings.CHANGEFEED_BATCH_SIZE)
+                if events:
+                    await handler(events)
+                    offset = events[-1]["offset"]
+                    await save_checkpoint(session, checkpoint, offset)
+                    await session.commit()
+            if len(events) < settings.CHANGEFEED_BATCH_SIZE:
+                await wait_for_changes(settings.CHANGEFEED_POLL_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Change feed subscriber {name} error: {str(e)}")
+            await asyncio.sleep(settings.CHANGEFEED_POLL_SECONDS)
+
+async def start_changefeed() -> List[asyncio.Task]:
+    await invalidation.subscribe(CHANNEL, _on_notify)
+    return [asyncio.create_task(_consume(name, handler)) for name, handler in _subscribers.items()]
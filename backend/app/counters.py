@@ -0,0 +1,86 @@
+# app/counters.py
+# O(1) per-tenant totals from tenant_counters (maintained by triggers, see models.py).
+#
+# Tenants whose data predates the triggers are seeded on startup (see main.py).
+# To recount everything from the base tables:
+#   python -m app.counters rebuild
+import asyncio
+import uuid
+from typing import Dict
+
+from sqlalchemy import select, func, delete, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from .db import SessionLocal
+from .models import TenantCounter
+
+COUNTERS = ("accounts", "subscriptions", "active_subscriptions", "mrr_cents", "churned_subscriptions")
+
+# Each counter's per-tenant value from its base table: (table, aggregate).
+# churned_subscriptions is history, not derivable from the base tables
+BASE_COUNTS = {
+    "accounts": ("accounts", "count(*)"),
+    "subscriptions": ("subscriptions", "count(*)"),
+    "active_subscriptions": ("subscriptions", "count(*) FILTER (WHERE status = 'active')"),
+    "mrr_cents": ("subscriptions", "coalesce(sum(amount_cents) FILTER (WHERE status = 'active'), 0)"),
+}
+REBUILT = tuple(BASE_COUNTS)
+# Seeded on startup for tenants that have base rows but no rows for the counter
+SEEDED = ("accounts", "subscriptions", "active_subscriptions", "mrr_cents")
+
+async def get_tenant_counters(session: AsyncSession, tenant_id: uuid.UUID) -> Dict[str, int]:
+    """Every counter for a tenant; reads at most a few rows per counter"""
+    result = await session.execute(
+        select(TenantCounter.counter, func.sum(TenantCounter.value))
+        .where(TenantCounter.tenant_id == tenant_id)
+        .group_by(TenantCounter.counter)
+    )
+    totals = {name: 0 for name in COUNTERS}
+    totals.update({name: int(value) for name, value in result.all()})
+    return totals
+
+async def rebuild_tenant_counters():
+    """Recount everything from the base tables"""
+    async with SessionLocal() as session:
+        # Block writers for the duration so no trigger increment is lost or doubled
+        await session.execute(text("LOCK TABLE accounts, subscriptions IN SHARE MODE"))
+        await session.execute(delete(TenantCounter).where(TenantCounter.counter.in_(REBUILT)))
+        await session.execute(text(
+            "INSERT INTO tenant_counters (tenant_id, counter, slot, value) "
+            + " UNION ALL ".join(
+                f"SELECT tenant_id, '{name}', 0, {value} FROM {table} GROUP BY tenant_id"
+                for name, (table, value) in BASE_COUNTS.items()
+            )
+        ))
+        await session.commit()
+
+async def seed_tenant_counters(conn: AsyncConnection):
+    """Count from the base tables for tenants that have rows there but none for a counter.
+
+    The triggers only see changes made after they were installed, so on a
+    database that already had data the counters would start at zero. Run it
+    in the transaction that installs the triggers, so no write falls between.
+    """
+    await conn.execute(text("LOCK TABLE accounts, subscriptions IN SHARE MODE"))
+    for name in SEEDED:
+        table, value = BASE_COUNTS[name]
+        tenants = (await conn.execute(text(f"""
+            SELECT t.id FROM tenants t
+            WHERE EXISTS (SELECT 1 FROM {table} b WHERE b.tenant_id = t.id)
+              AND NOT EXISTS (
+                  SELECT 1 FROM tenant_counters c WHERE c.tenant_id = t.id AND c.counter = :name
+              )
+        """), {"name": name})).scalars().all()
+        if tenants:
+            await conn.execute(text(f"""
+                INSERT INTO tenant_counters (tenant_id, counter, slot, value)
+                SELECT tenant_id, :name, 0, {value} FROM {table}
+                WHERE tenant_id = ANY(:tenants) GROUP BY tenant_id
+            """), {"name": name, "tenants": list(tenants)})
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["rebuild"]:
+        asyncio.run(rebuild_tenant_counters())
+    else:
+        print("usage: python -m app.counters rebuild")
@@ -23,6 +23,61 @@ class Settings(BaseSettings):
     # CORS origin for the frontend
     FRONTEND_ORIGIN: str = "http://localhost:3000"
 
+    # Account profile cache
+    ACCOUNT_CACHE_TTL_SECONDS: float = 60
+    ACCOUNT_CACHE_MAX_ENTRIES: int = 10000
+    # Rows per INSERT ... ON CONFLICT statement in the account upsert endpoint
+    ACCOUNT_UPSERT_BATCH_SIZE: int = 500
+    # Cache invalidation pub/sub: "local" (single process) or "postgres" (LISTEN/NOTIFY)
+    CACHE_PUBSUB_BACKEND: str = "local"
+    CACHE_PUBSUB_DSN: str = ""
+
+    # Offline geocoding; the worker only runs when a gazetteer path is set
+    GEOCODER_GAZETTEER_PATH: str = ""
+    GEOCODER_BATCH_SIZE: int = 1000
+    GEOCODER_INTERVAL_SECONDS: float = 300
+
+    # Account change feed (account_changes outbox)
+    CHANGEFEED_BATCH_SIZE: int = 500
+    CHANGEFEED_POLL_SECONDS: float = 1.0
+
+    # Search analytics rollups; day buckets follow this timezone
+    ANALYTICS_TIMEZONE: str = "UTC"
+    ROLLUP_BATCH_SIZE: int = 50000
+    MRR_SNAPSHOT_INTERVAL_SECONDS: float = 3600
+    ROLLUP_INTERVAL_SECONDS: float = 10
+
+    # Dashboard cache: fresh for TTL, then served stale while one refresh runs
+    DASHBOARD_CACHE_TTL_SECONDS: float = 5
+    DASHBOARD_CACHE_MAX_STALE_SECONDS: float = 60
+    LIVE_DASHBOARD_PUSH_SECONDS: float = 1.0
+    LIVE_DASHBOARD_RESYNC_SECONDS: float = 30
+    LIVE_DASHBOARD_QUEUE_SIZE: int = 16
+
+    # Top and trending queries (app/heavy_hitters.py)
+    HEAVY_HITTERS_CAPACITY: int = 1000
+    TRENDING_WINDOW_SECONDS: float = 900
+    POPULAR_HALF_LIFE_SECONDS: float = 86400
+    HEAVY_HITTERS_SNAPSHOT_SECONDS: float = 60
+    HEAVY_HITTERS_SNAPSHOT_TTL_SECONDS: int = 86400
+
+    # Columnar export for offline analytics (app/exports.py); disabled when empty
+    ANALYTICS_EXPORT_DIR: str = ""
+    EXPORT_FORMAT: str = "parquet"  # or "arrow" (Arrow IPC)
+    EXPORT_COMPRESSION: str = "zstd"
+    EXPORT_BATCH_SIZE: int = 100000
+    EXPORT_INTERVAL_SECONDS: float = 300
+
+    # LLM agents (app/routers/agents.py)
+    AGENT_MAX_CONCURRENCY: int = 32
+    AGENT_TIMEOUT_SECONDS: float = 120
+    # Response cache for identical generations; the disk tier is off when the dir is empty
+    AGENT_CACHE_ENABLED: bool = True
+    AGENT_CACHE_TTL_SECONDS: float = 86400
+    AGENT_CACHE_MAX_ENTRIES: int = 1000
+    AGENT_CACHE_DIR: str = ""
+    AGENT_CACHE_DIR_MAX_ENTRIES: int = 100000
+
     # Pydantic v2 config
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -0,0 +1,284 @@
+# app/exports.py
+# Incremental columnar export of search and subscription activity for offline analytics.
+#
+# Each stream's rows past its txid watermark are written as date-partitioned
+# Parquet (or Arrow IPC) files under ANALYTICS_EXPORT_DIR:
+#   search_logs/date=2024-05-01/part-<lo>.parquet
+#   search_results/date=2024-05-01/part-<lo>.parquet     (with their search)
+#   result_clicks/date=2024-05-01/part-<lo>.parquet      (search's date)
+#   subscription_events/date=2024-05-01/part-<lo>.parquet (subscription's created date)
+# Only append-only data is exported. Clicks and subscription status changes
+# are updates in Postgres, so triggers log them to result_clicks and
+# subscription_events (see models.py) and those logs are exported instead.
+# Parts are named after the watermark the batch started from: a batch re-run
+# after a crash or rollback starts from the same watermark and covers a
+# superset of the rows, so it overwrites its own files.
+#
+# Requires pyarrow (pip install pyarrow). Runs on startup when
+# ANALYTICS_EXPORT_DIR is set, or once with
+#   python -m app.exports run
+import asyncio
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select, text
+
+from .db import SessionLocal, settings
+from .jobs import load_checkpoint, save_checkpoint
+from .models import ResultClick, SearchLog, SearchResult, SubscriptionEvent
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+LOCK_KEY = 7_301_002
+
+# Any transaction that could still add rows is either open now (and listed
+# here) or starts after clock_timestamp(). Must be read before the batch's
+# snapshot. Only client sessions on this database can write our tables, and
+# only those of roles whose xact_start we can see count, so run the exporter
+# as the application role (or one with pg_read_all_stats).
+OPEN_TRANSACTIONS_SINCE = text("""
+    SELECT least(clock_timestamp(), min(xact_start))
+    FROM pg_stat_activity
+    WHERE datname = current_database() AND backend_type = 'client backend'
+      AND xact_start IS NOT NULL AND pid <> pg_backend_pid()
+""")
+
+NEXT_BATCH = """
+    SELECT max(txid), count(*) FROM (
+        SELECT txid FROM {stream}
+        WHERE txid > :lo AND txid < txid_snapshot_xmin(txid_current_snapshot())
+        ORDER BY txid LIMIT :batch_size
+    ) batch
+"""
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Analytics export needs pyarrow: pip install pyarrow")
+
+def schemas():
+    _require_pyarrow()
+    timestamp = pa.timestamp("us", tz="UTC")
+    return {
+        "search_logs": pa.schema([
+            ("id", pa.string()),
+            ("tenant_id", pa.string()),
+            ("search_query", pa.string()),
+            ("result_count", pa.int32()),
+            ("user_id", pa.string()),
+            ("created_at", timestamp),
+            ("txid", pa.int64()),
+        ]),
+        "search_results": pa.schema([
+            ("id", pa.string()),
+            ("search_log_id", pa.string()),
+            ("tenant_id", pa.string()),
+            ("account_id", pa.string()),
+            ("position", pa.int32()),
+            ("score", pa.float64()),
+            ("searched_at", timestamp),
+            ("txid", pa.int64()),
+        ]),
+        "result_clicks": pa.schema([
+            ("id", pa.int64()),
+            ("search_result_id", pa.string()),
+            ("search_log_id", pa.string()),
+            ("tenant_id", pa.string()),
+            ("account_id", pa.string()),
+            ("position", pa.int32()),
+            ("delta", pa.int32()),
+            ("searched_at", timestamp),
+            ("clicked_at", timestamp),
+            ("txid", pa.int64()),
+        ]),
+        "subscription_events": pa.schema([
+            ("id", pa.int64()),
+            ("subscription_id", pa.string()),
+            ("tenant_id", pa.string()),
+            ("account_id", pa.string()),
+            ("status", pa.string()),
+            ("amount_cents", pa.int32()),
+            ("created_at", timestamp),
+            ("changed_at", timestamp),
+            ("txid", pa.int64()),
+        ]),
+    }
+
+def _str(value):
+    return str(value) if value is not None else None
+
+def write_table(table, path: str):
+    """Write atomically: readers never see a half-written file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Dot-prefixed: dataset discovery skips it while it is being written
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, f".{name}.tmp")
+    if settings.EXPORT_FORMAT == "arrow":
+        options = pa.ipc.IpcWriteOptions(compression=settings.EXPORT_COMPRESSION or None)
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, tmp, compression=settings.EXPORT_COMPRESSION or "none")
+    os.replace(tmp, path)
+
+async def read_search_logs(session, lo: int, hi: int, tz: ZoneInfo) -> dict:
+    in_batch = (SearchLog.txid > lo) & (SearchLog.txid <= hi)
+    logs = await session.execute(
+        select(
+            SearchLog.id, SearchLog.tenant_id, SearchLog.search_query, SearchLog.result_count,
+            SearchLog.user_id, SearchLog.created_at, SearchLog.txid,
+        ).where(in_batch)
+    )
+    # Results are written in their search's transaction, so the log txid covers them
+    results = await session.execute(
+        select(
+            SearchResult.id, SearchResult.search_log_id, SearchLog.tenant_id, SearchResult.account_id,
+            SearchResult.position, SearchResult.score,
+            SearchLog.created_at, SearchLog.txid,
+        ).join(SearchLog, SearchResult.search_log_id == SearchLog.id).where(in_batch)
+    )
+
+    partitions = {"search_logs": defaultdict(list), "search_results": defaultdict(list)}
+    for row in logs.all():
+        day = row.created_at.astimezone(tz).date()
+        partitions["search_logs"][day].append(
+            (str(row.id), str(row.tenant_id), row.search_query, row.result_count,
+             _str(row.user_id), row.created_at, row.txid)
+        )
+    for row in results.all():
+        day = row.created_at.astimezone(tz).date()
+        partitions["search_results"][day].append(
+            (str(row.id), str(row.search_log_id), str(row.tenant_id), str(row.account_id),
+             row.position, float(row.score) if row.score is not None else None,
+             row.created_at, row.txid)
+        )
+    return partitions
+
+async def read_result_clicks(session, lo: int, hi: int, tz: ZoneInfo) -> dict:
+    clicks = await session.execute(
+        select(
+            ResultClick.id, ResultClick.search_result_id, ResultClick.search_log_id, ResultClick.tenant_id,
+            ResultClick.account_id, ResultClick.position, ResultClick.delta,
+            ResultClick.searched_at, ResultClick.clicked_at, ResultClick.txid,
+        ).where(ResultClick.txid > lo, ResultClick.txid <= hi)
+    )
+    partitions = {"result_clicks": defaultdict(list)}
+    for row in clicks.all():
+        # With the search, so a date range selects a search's results and clicks together
+        day = row.searched_at.astimezone(tz).date()
+        partitions["result_clicks"][day].append(
+            (row.id, str(row.search_result_id), str(row.search_log_id), str(row.tenant_id),
+             str(row.account_id), row.position, row.delta, row.searched_at, row.clicked_at, row.txid)
+        )
+    return partitions
+
+async def read_subscription_events(session, lo: int, hi: int, tz: ZoneInfo) -> dict:
+    events = await session.execute(
+        select(
+            SubscriptionEvent.id, SubscriptionEvent.subscription_id, SubscriptionEvent.tenant_id,
+            SubscriptionEvent.account_id, SubscriptionEvent.status, SubscriptionEvent.amount_cents,
+            SubscriptionEvent.created_at, SubscriptionEvent.changed_at, SubscriptionEvent.txid,
+        ).where(SubscriptionEvent.txid > lo, SubscriptionEvent.txid <= hi)
+    )
+    partitions = {"subscription_events": defaultdict(list)}
+    for row in events.all():
+        day = row.created_at.astimezone(tz).date()
+        partitions["subscription_events"][day].append(
+            (row.id, str(row.subscription_id), str(row.tenant_id), _str(row.account_id), row.status,
+             row.amount_cents, row.created_at, row.changed_at, row.txid)
+        )
+    return partitions
+
+# Each stream follows its own txid watermark:
+# table -> (checkpoint, time column its rows are stamped with, reader)
+STREAMS = {
+    "search_logs": ("search_log_export", "created_at", read_search_logs),
+    "result_clicks": ("result_click_export", "clicked_at", read_result_clicks),
+    "subscription_events": ("subscription_event_export", "changed_at", read_subscription_events),
+}
+
+def through_checkpoint(stream: str) -> str:
+    """Everything in the stream stamped before this time is on disk (see export_batch)"""
+    return f"{STREAMS[stream][0]}_through"
+
+async def export_batch(stream: str, batch_size: int) -> Optional[int]:
+    """Export the stream's next batch; returns the new watermark, or None when idle"""
+    _require_pyarrow()
+    checkpoint, stamped, reader = STREAMS[stream]
+    async with SessionLocal() as session:
+        # One exporter at a time across workers
+        locked = await session.scalar(text(f"SELECT pg_try_advisory_xact_lock({LOCK_KEY})"))
+        if not locked:
+            return None
+        horizon = await session.scalar(OPEN_TRANSACTIONS_SINCE)
+        lo = int(await load_checkpoint(session, checkpoint) or 0)
+        hi, count = (await session.execute(
+            text(NEXT_BATCH.format(stream=stream)), {"lo": lo, "batch_size": batch_size}
+        )).one()
+        if hi is not None:
+            partitions = await reader(session, lo, hi, ZoneInfo(settings.ANALYTICS_TIMEZONE))
+            await write_partitions(partitions, lo)
+            # Only advance once every file of the batch is in place
+            await save_checkpoint(session, checkpoint, str(hi))
+
+        if count < batch_size:
+            # Caught up: every committed row below the snapshot is exported, so
+            # the bound is the oldest row still pending or the open-transaction horizon
+            pending = await session.scalar(
+                text(f"SELECT min({stamped}) FROM {stream} WHERE txid > :after"), {"after": hi or lo}
+            )
+            through = min(horizon, pending) if pending is not None else horizon
+            previous = await load_checkpoint(session, through_checkpoint(stream))
+            if previous is None or through > datetime.fromisoformat(previous):
+                await save_checkpoint(session, through_checkpoint(stream), through.isoformat())
+        await session.commit()
+        return hi
+
+async def write_partitions(partitions: dict, lo: int):
+    """Write {table: {date: [rows]}} as one part per table and date"""
+    suffix = "arrow" if settings.EXPORT_FORMAT == "arrow" else "parquet"
+    all_schemas = schemas()
+    for name, days in partitions.items():
+        schema = all_schemas[name]
+        for day, rows in days.items():
+            columns = list(zip(*rows))
+            table = pa.table(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            )
+            path = os.path.join(
+                settings.ANALYTICS_EXPORT_DIR, name, f"date={day.isoformat()}", f"part-{lo}.{suffix}"
+            )
+            # Blocking file I/O off the event loop
+            await asyncio.to_thread(write_table, table, path)
+
+async def catch_up():
+    for stream in STREAMS:
+        # Shielded: cancelling the worker mid-batch (e.g. on shutdown) would roll
+        # back the checkpoint while the file writes carry on in their threads
+        while await asyncio.shield(export_batch(stream, settings.EXPORT_BATCH_SIZE)) is not None:
+            await asyncio.sleep(0)
+
+async def export_worker():
+    while True:
+        try:
+            await catch_up()
+        except Exception as e:
+            print(f"Analytics export error: {str(e)}")
+        await asyncio.sleep(settings.EXPORT_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["run"]:
+        if not settings.ANALYTICS_EXPORT_DIR:
+            sys.exit("Set ANALYTICS_EXPORT_DIR first")
+        asyncio.run(catch_up())
+    else:
+        print("usage: python -m app.exports run")
@@ -0,0 +1,27 @@
+# app/fieldsets.py
+# Sparse fieldsets: ?fields=name,city narrows both the SQL projection and the payload.
+import json
+from typing import Iterable, List, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """Requested field names in order, or None when every field is wanted"""
+    if fields is None:
+        return None
+    selected = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in allowed]
+    if not selected or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields requested",
+        )
+    return selected
+
+def dump_fields(item, selected: List[str]) -> dict:
+    """Pick the selected attributes off an ORM object or Row"""
+    return {name: getattr(item, name) for name in selected}
+
+def to_json(content) -> bytes:
+    return json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
@@ -0,0 +1,218 @@
+# app/geocoding.py
+# Offline batch geocoding of accounts against a local ZIP / city centroid gazetteer.
+#
+# Build the gazetteer once from a CSV with columns key,lat,lng where key is a
+# 5-digit ZIP or "city|state":
+#   python -m app.geocoding build centroids.csv centroids.gaz
+# Then point GEOCODER_GAZETTEER_PATH at it; the pipeline runs on startup, or once with
+#   python -m app.geocoding run
+import asyncio
+import csv
+import mmap
+import struct
+import sys
+import time
+import uuid
+from typing import Optional, Tuple
+
+from sqlalchemy import select, or_, text, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID, NUMERIC
+
+from .db import SessionLocal, settings
+from .models import Account
+from .jobs import load_checkpoint, save_checkpoint
+from .cache import invalidate_accounts, start_cache, stop_cache
+
+# File layout: b"GAZ1", uint32 record count, then fixed-width records sorted by key
+MAGIC = b"GAZ1"
+HEADER = struct.Struct("<4sI")
+KEY_SIZE = 32
+RECORD = struct.Struct(f"<{KEY_SIZE}sdd")
+
+def zip_key(zip_code: Optional[str]) -> Optional[str]:
+    digits = "".join(ch for ch in (zip_code or "") if ch.isdigit())
+    return digits[:5] if len(digits) >= 5 else None
+
+def city_key(city: Optional[str], state: Optional[str]) -> Optional[str]:
+    if not city or not state:
+        return None
+    return f"{' '.join(city.lower().split())}|{state.strip().lower()}"
+
+def _encode_key(key: str) -> bytes:
+    return key.encode("utf-8")[:KEY_SIZE].ljust(KEY_SIZE, b"\0")
+
+def build_gazetteer(csv_path: str, out_path: str) -> int:
+    """Convert a key,lat,lng CSV into the sorted binary gazetteer format"""
+    records = {}
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            key = row["key"].strip()
+            key = zip_key(key) if key.isdigit() else city_key(*key.split("|", 1)) if "|" in key else None
+            if key:
+                records[_encode_key(key)] = (float(row["lat"]), float(row["lng"]))
+    with open(out_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for key in sorted(records):
+            f.write(RECORD.pack(key, *records[key]))
+    return len(records)
+
+class Gazetteer:
+    """Memory-mapped centroid table with binary search over the sorted keys"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer file")
+
+    def _key_at(self, index: int) -> bytes:
+        offset = HEADER.size + index * RECORD.size
+        return self._mm[offset:offset + KEY_SIZE]
+
+    def lookup(self, key: str) -> Optional[Tuple[float, float]]:
+        target = _encode_key(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._key_at(lo) == target:
+            _, lat, lng = RECORD.unpack_from(self._mm, HEADER.size + lo * RECORD.size)
+            return lat, lng
+        return None
+
+    def resolve(self, zip_code: Optional[str], city: Optional[str], state: Optional[str]):
+        # ZIP centroids are tighter than city centroids, so try them first
+        for key in (zip_key(zip_code), city_key(city, state)):
+            if key:
+                found = self.lookup(key)
+                if found:
+                    return found
+        return None
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+class GeocodingStats:
+    def __init__(self):
+        self.scanned = 0
+        self.geocoded = 0
+        self.unresolved = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.last_run_at: Optional[float] = None
+
+    def as_dict(self):
+        return {
+            "scanned": self.scanned,
+            "geocoded": self.geocoded,
+            "unresolved": self.unresolved,
+            "batches": self.batches,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "rows_per_second": round(self.scanned / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+            "last_run_at": self.last_run_at,
+        }
+
+stats = GeocodingStats()
+
+CHECKPOINT = "geocoding"
+# Unique among our advisory locks (rollups 7_301_001, exports 7_301_002)
+LOCK_KEY = 7_301_003
+
+# One statement writes back a whole batch
+BULK_UPDATE = text("""
+    UPDATE accounts AS a
+    SET lat = u.lat, lng = u.lng, version = a.version + 1
+    FROM unnest(:ids, :lats, :lngs) AS u(id, lat, lng)
+    WHERE a.id = u.id AND a.lat IS NULL
+""").bindparams(
+    bindparam("ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("lats", type_=ARRAY(NUMERIC(9, 6))),
+    bindparam("lngs", type_=ARRAY(NUMERIC(9, 6))),
+)
+
+async def geocode_batch(gazetteer: Gazetteer, batch_size: int) -> bool:
+    """Geocode the next batch after the saved cursor; False once a pass is complete or another worker has it"""
+    started = time.perf_counter()
+    async with SessionLocal() as session:
+        # One geocoder at a time across workers; they share the cursor
+        locked = await session.scalar(text(f"SELECT pg_try_advisory_xact_lock({LOCK_KEY})"))
+        if not locked:
+            return False
+        position = await load_checkpoint(session, CHECKPOINT)
+        cursor = uuid.UUID(position) if position else None
+        query = select(
+            Account.id, Account.bus_zip, Account.bus_city, Account.bus_state
+        ).where(
+            Account.lat.is_(None),
+            or_(Account.bus_zip.is_not(None), Account.bus_city.is_not(None)),
+        ).order_by(Account.id).limit(batch_size)
+        if cursor:
+            query = query.where(Account.id > cursor)
+        rows = (await session.execute(query)).all()
+
+        ids, lats, lngs = [], [], []
+        for row in rows:
+            found = gazetteer.resolve(row.bus_zip, row.bus_city, row.bus_state)
+            if found:
+                ids.append(row.id)
+                lats.append(round(found[0], 6))
+                lngs.append(round(found[1], 6))
+
+        if ids:
+            await session.execute(BULK_UPDATE, {"ids": ids, "lats": lats, "lngs": lngs})
+        # Cursor and coordinates commit together, so a restart resumes cleanly;
+        # a short batch means the pass is done and the next one starts over
+        next_cursor = rows[-1].id if len(rows) == batch_size else None
+        await save_checkpoint(session, CHECKPOINT, str(next_cursor) if next_cursor else None)
+        await session.commit()
+
+    await invalidate_accounts(ids)
+
+    stats.scanned += len(rows)
+    stats.geocoded += len(ids)
+    stats.unresolved += len(rows) - len(ids)
+    stats.batches += 1
+    stats.busy_seconds += time.perf_counter() - started
+    return len(rows) == batch_size
+
+async def run_pass(gazetteer: Gazetteer, batch_size: int):
+    while await geocode_batch(gazetteer, batch_size):
+        await asyncio.sleep(0)
+    stats.last_run_at = time.time()
+
+async def geocoding_worker():
+    """Background loop: one full pass, then sleep and look for new rows"""
+    gazetteer = Gazetteer(settings.GEOCODER_GAZETTEER_PATH)
+    try:
+        while True:
+            try:
+                await run_pass(gazetteer, settings.GEOCODER_BATCH_SIZE)
+            except Exception as e:
+                print(f"Geocoding error: {str(e)}")
+            await asyncio.sleep(settings.GEOCODER_INTERVAL_SECONDS)
+    finally:
+        gazetteer.close()
+
+async def _run_once():
+    # Start the invalidation backend so running workers drop stale profiles
+    await start_cache()
+    gazetteer = Gazetteer(settings.GEOCODER_GAZETTEER_PATH)
+    try:
+        await run_pass(gazetteer, settings.GEOCODER_BATCH_SIZE)
+    finally:
+        gazetteer.close()
+        await stop_cache()
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        print(f"wrote {build_gazetteer(sys.argv[2], sys.argv[3])} records")
+    elif len(sys.argv) == 2 and sys.argv[1] == "run":
+        asyncio.run(_run_once())
+        print(stats.as_dict())
+    else:
+        print("usage: python -m app.geocoding build <csv> <out> | run")
@@ -0,0 +1,237 @@
+# app/heavy_hitters.py
+# Popular and trending search queries from in-memory Space-Saving sketches.
+#
+# Every worker keeps a sketch per tenant, updated as searches are logged, and
+# periodically saves a snapshot to query_sketch_snapshots. Reads merge this
+# worker's live sketches with the other workers' recent snapshots, so nothing
+# ever has to GROUP BY search_logs.
+import asyncio
+import heapq
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .db import SessionLocal, settings
+from .models import QuerySketchSnapshot
+
+WORKER_ID = uuid.uuid4()
+
+def normalize_query(query: str) -> str:
+    # Same normalization as the rollups: lower(btrim(search_query))
+    return query.strip().lower()
+
+class SpaceSaving:
+    """Top-k counter in bounded memory (Metwally et al.).
+
+    Counts can overestimate by at most the recorded error; items with true
+    frequency above total/capacity are guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity: int, counts: Optional[Dict[str, List[float]]] = None):
+        self.capacity = capacity
+        # item -> [count, error]
+        self.counts: Dict[str, List[float]] = counts or {}
+        # Lazy min-heap of (count, item); stale entries are skipped on pop
+        self._heap: List[Tuple[float, str]] = [(c, item) for item, (c, _) in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[str, float]:
+        while True:
+            count, item = heapq.heappop(self._heap)
+            entry = self.counts.get(item)
+            if entry is not None and entry[0] == count:
+                return item, count
+
+    def add(self, item: str, weight: float = 1):
+        entry = self.counts.get(item)
+        if entry is None:
+            if len(self.counts) < self.capacity:
+                entry = self.counts[item] = [0.0, 0.0]
+            else:
+                # Replace the smallest counter; its count becomes our error bound
+                evicted, floor = self._pop_min()
+                del self.counts[evicted]
+                entry = self.counts[item] = [floor, floor]
+        entry[0] += weight
+        heapq.heappush(self._heap, (entry[0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(c, item) for item, (c, _) in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def scale(self, factor: float):
+        for entry in self.counts.values():
+            entry[0] *= factor
+            entry[1] *= factor
+        self._rebuild_heap()
+
+    def merge(self, other: "SpaceSaving", factor: float = 1.0):
+        for item, (count, error) in other.counts.items():
+            entry = self.counts.setdefault(item, [0.0, 0.0])
+            entry[0] += count * factor
+            entry[1] += error * factor
+        # Keep the largest counters
+        if len(self.counts) > self.capacity:
+            keep = heapq.nlargest(self.capacity, self.counts.items(), key=lambda kv: kv[1][0])
+            self.counts = {item: entry for item, entry in keep}
+        self._rebuild_heap()
+
+    def top(self, k: int) -> List[Tuple[str, float, float]]:
+        return [
+            (item, count, error)
+            for item, (count, error) in heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1][0])
+        ]
+
+    def estimate(self, item: str) -> float:
+        entry = self.counts.get(item)
+        return entry[0] if entry else 0.0
+
+    def to_list(self):
+        return [[item, count, error] for item, (count, error) in self.counts.items()]
+
+    @classmethod
+    def from_list(cls, capacity: int, data) -> "SpaceSaving":
+        return cls(capacity, {item: [count, error] for item, count, error in data})
+
+class QueryTrends:
+    """Per-tenant sketches: decayed popularity plus current/previous windows"""
+
+    def __init__(self):
+        capacity = settings.HEAVY_HITTERS_CAPACITY
+        self.popular = SpaceSaving(capacity)
+        self.current = SpaceSaving(capacity)
+        self.previous = SpaceSaving(capacity)
+        self.window_started = time.time()
+
+    def rotate(self, now: float):
+        window = settings.TRENDING_WINDOW_SECONDS
+        while now - self.window_started >= window:
+            self.previous = self.current
+            self.current = SpaceSaving(settings.HEAVY_HITTERS_CAPACITY)
+            self.window_started += window
+            # Older searches count for less in "popular"
+            self.popular.scale(0.5 ** (window / settings.POPULAR_HALF_LIFE_SECONDS))
+
+    def add(self, query: str):
+        self.rotate(time.time())
+        self.popular.add(query)
+        self.current.add(query)
+
+    def to_dict(self):
+        return {
+            "popular": self.popular.to_list(),
+            "current": self.current.to_list(),
+            "previous": self.previous.to_list(),
+            "window_started": self.window_started,
+        }
+
+_trends: Dict[uuid.UUID, QueryTrends] = {}
+
+def record_search(tenant_id: uuid.UUID, query: str):
+    query = normalize_query(query)
+    if query:
+        trends = _trends.get(tenant_id)
+        if trends is None:
+            trends = _trends[tenant_id] = QueryTrends()
+        trends.add(query)
+
+async def _merged(session, tenant_id: uuid.UUID) -> QueryTrends:
+    """This worker's live sketches merged with the other workers' snapshots"""
+    now = time.time()
+    merged = QueryTrends()
+    starts = []
+    local = _trends.get(tenant_id)
+    if local is not None:
+        local.rotate(now)
+        starts.append(local.window_started)
+        merged.popular.merge(local.popular)
+        merged.current.merge(local.current)
+        merged.previous.merge(local.previous)
+
+    capacity = settings.HEAVY_HITTERS_CAPACITY
+    window = settings.TRENDING_WINDOW_SECONDS
+    snapshots = await session.execute(
+        select(QuerySketchSnapshot.data).where(
+            QuerySketchSnapshot.tenant_id == tenant_id,
+            QuerySketchSnapshot.worker_id != WORKER_ID
+        )
+    )
+    for (data,) in snapshots.all():
+        age = now - data["window_started"]
+        # Decay frozen snapshots as if they had kept running
+        merged.popular.merge(
+            SpaceSaving.from_list(capacity, data["popular"]),
+            0.5 ** (age / settings.POPULAR_HALF_LIFE_SECONDS),
+        )
+        # Windows only line up if the snapshot is from the current or previous window
+        if age < window:
+            starts.append(data["window_started"])
+            merged.current.merge(SpaceSaving.from_list(capacity, data["current"]))
+            merged.previous.merge(SpaceSaving.from_list(capacity, data["previous"]))
+        elif age < 2 * window:
+            merged.previous.merge(SpaceSaving.from_list(capacity, data["current"]))
+    # Earliest start gives the most conservative rate for a partial window
+    merged.window_started = min(starts, default=now)
+    return merged
+
+async def top_queries(session, tenant_id: uuid.UUID, k: int):
+    merged = await _merged(session, tenant_id)
+    return [
+        {"query": item, "score": round(count, 2), "max_error": round(error, 2)}
+        for item, count, error in merged.popular.top(k)
+    ]
+
+async def trending_queries(session, tenant_id: uuid.UUID, k: int, min_count: int = 3):
+    merged = await _merged(session, tenant_id)
+    # Rate of change between the current window (scaled to a full window) and the previous one
+    elapsed = max(time.time() - merged.window_started, 1.0)
+    scale = min(settings.TRENDING_WINDOW_SECONDS / elapsed, 10.0)
+    scored = []
+    for item, count, _ in merged.current.top(settings.HEAVY_HITTERS_CAPACITY):
+        if count < min_count:
+            continue
+        rate = count * scale
+        before = merged.previous.estimate(item)
+        scored.append((item, rate, before, (rate - before) / (before + min_count)))
+    scored.sort(key=lambda row: row[3], reverse=True)
+    return [
+        {"query": item, "current": round(rate, 2), "previous": round(before, 2), "growth": round(growth, 3)}
+        for item, rate, before, growth in scored[:k]
+    ]
+
+async def save_snapshots():
+    if not _trends:
+        return
+    async with SessionLocal() as session:
+        stmt = pg_insert(QuerySketchSnapshot).values([
+            {"worker_id": WORKER_ID, "tenant_id": tenant_id, "data": trends.to_dict()}
+            for tenant_id, trends in _trends.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[QuerySketchSnapshot.worker_id, QuerySketchSnapshot.tenant_id],
+            set_={"data": stmt.excluded.data, "saved_at": func.now()},
+        )
+        await session.execute(stmt)
+        # Snapshots from workers that are long gone
+        await session.execute(
+            delete(QuerySketchSnapshot).where(
+                QuerySketchSnapshot.saved_at
+                < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, settings.HEAVY_HITTERS_SNAPSHOT_TTL_SECONDS)
+            )
+        )
+        await session.commit()
+
+async def snapshot_worker():
+    while True:
+        await asyncio.sleep(settings.HEAVY_HITTERS_SNAPSHOT_SECONDS)
+        try:
+            for trends in _trends.values():
+                trends.rotate(time.time())
+            await save_snapshots()
+        except Exception as e:
+            print(f"Query sketch snapshot error: {str(e)}")
@@ -0,0 +1,23 @@
+# app/jobs.py
+# Resume positions for background jobs, stored in job_checkpoints.
+from typing import Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import JobCheckpoint
+
+async def load_checkpoint(session: AsyncSession, name: str) -> Optional[str]:
+    return await session.scalar(
+        select(JobCheckpoint.position).where(JobCheckpoint.name == name)
+    )
+
+async def save_checkpoint(session: AsyncSession, name: str, position: Optional[str]):
+    # Written in the caller's transaction so it commits with the job's own writes
+    stmt = pg_insert(JobCheckpoint).values(name=name, position=position)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[JobCheckpoint.name],
+        set_={"position": stmt.excluded.position, "updated_at": func.now()},
+    )
+    await session.execute(stmt)
@@ -0,0 +1,120 @@
+# app/live.py
+# Live dashboard push: deltas recorded on the write path, fanned out to viewers.
+#
+# Writers call record() (a dict increment, no I/O). Once per tick the worker
+# publishes its coalesced deltas on the invalidation backend, so with the
+# postgres backend every worker hears every worker's writes. Each worker keeps
+# one DashboardHub per tenant that encodes an event once and hands the same
+# frame to every viewer's bounded queue. Subscription/MRR changes come from the
+# database triggers, so hubs also resync from a full snapshot periodically.
+import asyncio
+import json
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from .cache import invalidation
+from .db import settings
+
+CHANNEL = "dashboard_deltas"
+# Queued in place of events a slow viewer missed; the viewer gets the current state instead
+RESYNC = object()
+
+SnapshotLoader = Callable[[], Awaitable[dict]]
+
+def frame(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class DashboardHub:
+    """Every viewer of one tenant's dashboard on this worker"""
+
+    def __init__(self, loader: SnapshotLoader):
+        self.loader = loader
+        self.viewers: Set[asyncio.Queue] = set()
+        # Last snapshot with every delta since applied
+        self.state: Optional[dict] = None
+        self.synced_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=settings.LIVE_DASHBOARD_QUEUE_SIZE)
+        self.viewers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.viewers.discard(queue)
+
+    def broadcast(self, message):
+        for queue in self.viewers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Never block the fan-out on one slow client
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+    def apply(self, deltas: Dict[str, int]):
+        if self.state is not None:
+            for name, delta in deltas.items():
+                self.state[name] = self.state.get(name, 0) + delta
+        self.broadcast(frame("delta", deltas))
+
+    async def ensure_state(self):
+        # Viewers arriving together share one initial load
+        async with self._lock:
+            if self.state is None:
+                await self.resync()
+
+    async def resync(self):
+        self.state = dict(await self.loader())
+        self.synced_at = time.monotonic()
+        self.broadcast(frame("snapshot", self.state))
+
+_hubs: Dict[uuid.UUID, DashboardHub] = {}
+# Deltas recorded on this worker since the last tick: tenant -> name -> delta
+_outbox: Dict[uuid.UUID, Dict[str, int]] = {}
+
+def get_hub(tenant_id: uuid.UUID, loader: SnapshotLoader) -> DashboardHub:
+    hub = _hubs.get(tenant_id)
+    if hub is None:
+        hub = _hubs[tenant_id] = DashboardHub(loader)
+    return hub
+
+def record(tenant_id: uuid.UUID, name: str, delta: int = 1):
+    deltas = _outbox.setdefault(tenant_id, {})
+    deltas[name] = deltas.get(name, 0) + delta
+
+def _on_deltas(channel: str, payload: str):
+    message = json.loads(payload)
+    hub = _hubs.get(uuid.UUID(message["tenant_id"]))
+    if hub is not None and hub.viewers:
+        hub.apply(message["deltas"])
+
+async def _tick():
+    global _outbox
+    outbox, _outbox = _outbox, {}
+    for tenant_id, deltas in outbox.items():
+        await invalidation.publish(CHANNEL, json.dumps({"tenant_id": str(tenant_id), "deltas": deltas}))
+
+    now = time.monotonic()
+    for tenant_id, hub in list(_hubs.items()):
+        if not hub.viewers:
+            del _hubs[tenant_id]
+        elif now - hub.synced_at >= settings.LIVE_DASHBOARD_RESYNC_SECONDS:
+            await hub.resync()
+
+def _on_reconnect():
+    # Deltas published while disconnected are gone; resync on the next tick
+    for hub in _hubs.values():
+        hub.synced_at = 0.0
+
+async def live_dashboard_worker():
+    await invalidation.subscribe(CHANNEL, _on_deltas)
+    invalidation.on_reconnect(_on_reconnect)
+    while True:
+        await asyncio.sleep(settings.LIVE_DASHBOARD_PUSH_SECONDS)
+        try:
+            await _tick()
+        except Exception as e:
+            print(f"Live dashboard error: {str(e)}")
@@ -1,12 +1,25 @@
 # app/main.py
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import select
+from sqlalchemy import DDL, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from .db import engine, Base, get_session, settings
-from .models import Account  # Import your models
+from .cache import start_cache, stop_cache
+from . import geocoding
+from . import exports
+from .rollups import rollup_worker
+from .mrr import mrr_snapshot_worker
+from .heavy_hitters import snapshot_worker
+from .live import live_dashboard_worker
+from .counters import seed_tenant_counters
+from .changefeed import start_changefeed
+from .models import Account, JobCheckpoint, SCHEMA_DDL, SCHEMA_DDL_VERSION  # Import your models
 # from .routers.tasks import router as tasks_router  # Comment out for now
 from .routers import search
 from .routers import agents
+from .routers import accounts
+from .routers import analytics
 
 # Load environment variables from .env file
 # Now your OPENAI_API_KEY will be available
@@ -22,12 +35,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser clients read conditional-request and paging headers
+    expose_headers=["ETag", "X-Total-Count"],
 )
+# Unique among our advisory locks (rollups, exports, geocoding use 7_301_00x)
+STARTUP_LOCK_KEY = 7_301_000
+SCHEMA_DDL_CHECKPOINT = "schema_ddl"
+
+async def install_schema_ddl(conn):
+    """(Re)install functions and triggers when models.SCHEMA_DDL changed since the last install"""
+    installed = await conn.scalar(
+        select(JobCheckpoint.position).where(JobCheckpoint.name == SCHEMA_DDL_CHECKPOINT)
+    )
+    if installed == SCHEMA_DDL_VERSION:
+        return
+    for statement in SCHEMA_DDL:
+        await conn.execute(DDL(statement))
+    # Same transaction as the trigger install, so no write falls in between
+    await seed_tenant_counters(conn)
+    stmt = pg_insert(JobCheckpoint).values(name=SCHEMA_DDL_CHECKPOINT, position=SCHEMA_DDL_VERSION)
+    await conn.execute(stmt.on_conflict_do_update(
+        index_elements=[JobCheckpoint.name],
+        set_={"position": stmt.excluded.position, "updated_at": func.now()},
+    ))
+
 @app.on_event("startup")
 async def on_startup():
-    # Create tables if missing
     async with engine.begin() as conn:
+        # Workers start one at a time; the others then find nothing to do
+        await conn.execute(text(f"SELECT pg_advisory_xact_lock({STARTUP_LOCK_KEY})"))
+        # Create tables if missing
         await conn.run_sync(Base.metadata.create_all)
+        await install_schema_ddl(conn)
+    await start_cache()
+    # Background jobs
+    app.state.background_tasks = await start_changefeed()
+    app.state.background_tasks.append(asyncio.create_task(rollup_worker()))
+    app.state.background_tasks.append(asyncio.create_task(mrr_snapshot_worker()))
+    app.state.background_tasks.append(asyncio.create_task(snapshot_worker()))
+    app.state.background_tasks.append(asyncio.create_task(live_dashboard_worker()))
+    if settings.GEOCODER_GAZETTEER_PATH:
+        app.state.background_tasks.append(asyncio.create_task(geocoding.geocoding_worker()))
+    if settings.ANALYTICS_EXPORT_DIR:
+        app.state.background_tasks.append(asyncio.create_task(exports.export_worker()))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in app.state.background_tasks:
+        task.cancel()
+    await stop_cache()
 
 @app.get("/")
 async def root():
@@ -37,8 +93,14 @@ async def root():
 async def ping():
     return {"ok": True}
 
+@app.get("/geocoding/stats")
+async def geocoding_stats():
+    return geocoding.stats.as_dict()
+
 app.include_router(search.router)
 app.include_router(agents.router)
+app.include_router(accounts.router)
+app.include_router(analytics.router)
 
 # Test endpoint to verify database connection
 @app.get("/test-db")
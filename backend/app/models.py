@@ -1,12 +1,16 @@
 # app/models.py
-from sqlalchemy import String, Text, TIMESTAMP, Boolean, Integer, DECIMAL, JSON, ForeignKey, UUID, func
+from sqlalchemy import String, Text, TIMESTAMP, Boolean, Integer, BigInteger, LargeBinary, DECIMAL, JSON, ForeignKey, UUID, Index, func, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
-from .db import Base
+from .db import Base, settings
+import hashlib
 import uuid
 from datetime import datetime
 from typing import Optional, List
 
+# The DDL below needs PostgreSQL 12+ (date_trunc with a time zone). It sticks
+# to txid_current() and DROP/CREATE TRIGGER rather than the 13+/14+ forms.
+
 class Tenant(Base):
     __tablename__ = "tenants"
     
@@ -46,10 +50,22 @@ class Account(Base):
     bus_state: Mapped[Optional[str]] = mapped_column(Text)
     bus_zip: Mapped[Optional[str]] = mapped_column(Text)
     
+    # Row version, bumped on every update; used for ETags
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
+    
     # Relationships
     tenant: Mapped["Tenant"] = relationship(back_populates="accounts")
     subscriptions: Mapped[List["Subscription"]] = relationship(back_populates="account")
     search_results: Mapped[List["SearchResult"]] = relationship(back_populates="account")
+    
+    __table_args__ = (
+        # Covering index so ETag checks read the version without touching the row
+        Index("ix_accounts_id_version", "id", postgresql_include=["version"]),
+        # Natural key for CRM sync upserts
+        Index("uq_accounts_tenant_email", "tenant_id", "email_address", unique=True),
+        # Keeps the geocoding scan cheap as the backlog of null coordinates shrinks
+        Index("ix_accounts_ungeocoded", "id", postgresql_where=text("lat IS NULL")),
+    )
 
 class Category(Base):
     __tablename__ = "categories"
@@ -70,9 +86,19 @@ class SearchLog(Base):
     result_count: Mapped[int] = mapped_column(Integer, default=0)
     user_id: Mapped[Optional[uuid.UUID]] = mapped_column(ForeignKey("users.id"))
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    # Writing transaction id; background aggregators use it as their watermark
+    txid: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, server_default=text("txid_current()")
+    )
     
     # Relationships
     search_results: Mapped[List["SearchResult"]] = relationship(back_populates="search_log")
+    
+    __table_args__ = (
+        Index("ix_search_logs_txid", "txid"),
+        # Tenant-scoped time range scans (minute series, today's pending count)
+        Index("ix_search_logs_tenant_created", "tenant_id", "created_at"),
+    )
 
 class SearchResult(Base):
     __tablename__ = "search_results"
@@ -87,6 +113,13 @@ class SearchResult(Base):
     # Relationships
     search_log: Mapped["SearchLog"] = relationship(back_populates="search_results")
     account: Mapped["Account"] = relationship(back_populates="search_results")
+    
+    __table_args__ = (
+        # Clicks are rare; the funnel only ever joins to clicked results
+        Index("ix_search_results_clicked", "search_log_id", postgresql_where=text("was_clicked")),
+        # Rollup batches reach results through their search
+        Index("ix_search_results_search_log_id", "search_log_id"),
+    )
 
 class User(Base):
     __tablename__ = "users"
@@ -106,8 +139,327 @@ class Subscription(Base):
     product_id: Mapped[Optional[uuid.UUID]] = mapped_column(ForeignKey("products.id"))
     status: Mapped[str] = mapped_column(String(50), nullable=False, default='pending')
     amount_cents: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
     
     # Relationships
     account: Mapped["Account"] = relationship(back_populates="subscriptions")
+    
+    __table_args__ = (
+        # Conversion lookups: this account's subscriptions within a window
+        Index("ix_subscriptions_account_created", "account_id", "created_at"),
+    )
+
+    
+class JobCheckpoint(Base):
+    """Resume position for background jobs (cursor or watermark)"""
+    __tablename__ = "job_checkpoints"
+    
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    position: Mapped[Optional[str]] = mapped_column(Text)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class AccountChange(Base):
+    """Outbox of account mutations, written by a trigger on accounts"""
+    __tablename__ = "account_changes"
+    
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # Writing transaction id; the change feed only reads below the oldest running one
+    txid: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, server_default=text("txid_current()")
+    )
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    account_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    op: Mapped[str] = mapped_column(String(10), nullable=False)
+    version: Mapped[Optional[int]] = mapped_column(Integer)
+    changed_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index("ix_account_changes_txid_id", "txid", "id"),
+    )
+
+# Functions and triggers, installed by main.py's startup when SCHEMA_DDL_VERSION
+# (a hash of these statements) differs from the one recorded in the database.
+SCHEMA_DDL: List[str] = []
+
+# The outbox row is written by the same statement that changes accounts, so it
+# commits or rolls back with it no matter which code path did the write.
+SCHEMA_DDL.append("""
+CREATE OR REPLACE FUNCTION record_account_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO account_changes (tenant_id, account_id, op, version)
+        VALUES (OLD.tenant_id, OLD.id, 'delete', OLD.version);
+    ELSE
+        INSERT INTO account_changes (tenant_id, account_id, op, version)
+        VALUES (NEW.tenant_id, NEW.id, lower(TG_OP), NEW.version);
+    END IF;
+    -- Empty payload so NOTIFY collapses to one per transaction
+    PERFORM pg_notify('account_changes', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""")
+SCHEMA_DDL.append("DROP TRIGGER IF EXISTS accounts_outbox ON accounts")
+SCHEMA_DDL.append("""
+CREATE TRIGGER accounts_outbox
+AFTER INSERT OR UPDATE OR DELETE ON accounts
+FOR EACH ROW EXECUTE FUNCTION record_account_change()
+""")
+
+class TenantCounter(Base):
+    """Per-tenant running totals, kept exact by triggers on accounts and subscriptions.
+
+    Each counter is split over a few slots so concurrent writers in one tenant
+    don't all queue on the same row; the value is the sum of the slots.
+    """
+    __tablename__ = "tenant_counters"
+    
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    counter: Mapped[str] = mapped_column(String(50), primary_key=True)
+    slot: Mapped[int] = mapped_column(Integer, primary_key=True)
+    value: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+TENANT_COUNTER_SLOTS = 8
+
+SCHEMA_DDL.append(f"""
+CREATE OR REPLACE FUNCTION bump_tenant_counter(t uuid, c text, delta bigint) RETURNS void AS $$
+BEGIN
+    IF t IS NULL OR delta = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO tenant_counters (tenant_id, counter, slot, value)
+    VALUES (t, c, floor(random() * {TENANT_COUNTER_SLOTS})::int, delta)
+    ON CONFLICT (tenant_id, counter, slot)
+    DO UPDATE SET value = tenant_counters.value + excluded.value;
+END
+$$ LANGUAGE plpgsql
+""")
+SCHEMA_DDL.append("""
+CREATE OR REPLACE FUNCTION count_account_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_tenant_counter(OLD.tenant_id, 'accounts', -1);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM bump_tenant_counter(NEW.tenant_id, 'accounts', 1);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""")
+SCHEMA_DDL.append("DROP TRIGGER IF EXISTS accounts_counters ON accounts")
+SCHEMA_DDL.append("""
+CREATE TRIGGER accounts_counters
+AFTER INSERT OR DELETE OR UPDATE OF tenant_id ON accounts
+FOR EACH ROW EXECUTE FUNCTION count_account_change()
+""")
+SCHEMA_DDL.append("""
+CREATE OR REPLACE FUNCTION count_subscription_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_tenant_counter(OLD.tenant_id, 'subscriptions', -1);
+        PERFORM bump_tenant_counter(OLD.tenant_id, 'active_subscriptions', -(OLD.status = 'active')::int);
+        PERFORM bump_tenant_counter(OLD.tenant_id, 'mrr_cents', -(OLD.status = 'active')::int * OLD.amount_cents);
+        -- Monotonic; daily churn is the difference between snapshots
+        IF OLD.status = 'active' AND (TG_OP = 'DELETE' OR NEW.status IS DISTINCT FROM 'active') THEN
+            PERFORM bump_tenant_counter(OLD.tenant_id, 'churned_subscriptions', 1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM bump_tenant_counter(NEW.tenant_id, 'subscriptions', 1);
+        PERFORM bump_tenant_counter(NEW.tenant_id, 'active_subscriptions', (NEW.status = 'active')::int);
+        PERFORM bump_tenant_counter(NEW.tenant_id, 'mrr_cents', (NEW.status = 'active')::int * NEW.amount_cents);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""")
+SCHEMA_DDL.append("DROP TRIGGER IF EXISTS subscriptions_counters ON subscriptions")
+SCHEMA_DDL.append("""
+CREATE TRIGGER subscriptions_counters
+AFTER INSERT OR DELETE OR UPDATE OF tenant_id, status, amount_cents ON subscriptions
+FOR EACH ROW EXECUTE FUNCTION count_subscription_change()
+""")
+
+class SubscriptionEvent(Base):
+    """Append-only log of subscription rows as they change, written by a trigger
+    on subscriptions so the analytics export (app/exports.py) can ship them"""
+    __tablename__ = "subscription_events"
+    
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    subscription_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    account_id: Mapped[Optional[uuid.UUID]] = mapped_column(PG_UUID(as_uuid=True))
+    # The row's status after the change; 'deleted' when the row went away
+    status: Mapped[str] = mapped_column(String(50), nullable=False)
+    amount_cents: Mapped[int] = mapped_column(Integer, nullable=False)
+    # The subscription's own created_at
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    changed_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    txid: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, server_default=text("txid_current()")
+    )
+    
+    __table_args__ = (
+        Index("ix_subscription_events_txid", "txid"),
+        Index("ix_subscription_events_subscription_id", "subscription_id"),
+    )
+
+SCHEMA_DDL.append("""
+CREATE OR REPLACE FUNCTION record_subscription_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO subscription_events (subscription_id, tenant_id, account_id, status, amount_cents, created_at)
+        VALUES (OLD.id, OLD.tenant_id, OLD.account_id, 'deleted', OLD.amount_cents, OLD.created_at);
+    ELSE
+        INSERT INTO subscription_events (subscription_id, tenant_id, account_id, status, amount_cents, created_at)
+        VALUES (NEW.id, NEW.tenant_id, NEW.account_id, NEW.status, NEW.amount_cents, NEW.created_at);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""")
+SCHEMA_DDL.append("DROP TRIGGER IF EXISTS subscriptions_events ON subscriptions")
+SCHEMA_DDL.append("""
+CREATE TRIGGER subscriptions_events
+AFTER INSERT OR DELETE OR UPDATE OF tenant_id, account_id, status, amount_cents, created_at ON subscriptions
+FOR EACH ROW EXECUTE FUNCTION record_subscription_change()
+""")
+# Subscriptions from before the trigger; the trigger holds off writers until this commits
+SCHEMA_DDL.append("""
+INSERT INTO subscription_events (subscription_id, tenant_id, account_id, status, amount_cents, created_at)
+SELECT s.id, s.tenant_id, s.account_id, s.status, s.amount_cents, s.created_at
+FROM subscriptions s
+WHERE NOT EXISTS (SELECT 1 FROM subscription_events e WHERE e.subscription_id = s.id)
+""")
+
+class SearchRollup(Base):
+    """Search counts per tenant and hour/day bucket, built from search_logs"""
+    __tablename__ = "search_rollups"
+    
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    granularity: Mapped[str] = mapped_column(String(10), primary_key=True)  # 'hour' or 'day'
+    bucket: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    searches: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    zero_results: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    unique_queries: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+class SearchRollupQuery(Base):
+    """Normalized queries already counted toward a bucket's unique_queries"""
+    __tablename__ = "search_rollup_queries"
+    
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    granularity: Mapped[str] = mapped_column(String(10), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    # md5 of the normalized query, stored as uuid to keep the key small
+    query_hash: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+
+class SearchSketch(Base):
+    """Per tenant and day HyperLogLog sketches (see app/hll.py), mergeable across days"""
+    __tablename__ = "search_sketches"
+    
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    day: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    searchers: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    queries: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+class AccountDailyStat(Base):
+    """Per tenant, account and day search impressions and clicks.
+    Impressions and position_sum are folded in by the rollup batches (app/rollups.py);
+    clicks arrive later as updates, so a trigger on search_results keeps them.
+    """
+    __tablename__ = "account_daily_stats"
+    
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    account_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    day: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    impressions: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    clicks: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    position_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+class ResultClick(Base):
+    """Append-only log of clicks (+1) and unclicks (-1) on search results, written
+    by the click trigger so the analytics export (app/exports.py) can ship them"""
+    __tablename__ = "result_clicks"
+    
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    search_result_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    search_log_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    account_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), nullable=False)
+    position: Mapped[int] = mapped_column(Integer, nullable=False)
+    delta: Mapped[int] = mapped_column(Integer, nullable=False)
+    # The search's created_at
+    searched_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    clicked_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    txid: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, server_default=text("txid_current()")
+    )
+    
+    __table_args__ = (
+        Index("ix_result_clicks_txid", "txid"),
+        Index("ix_result_clicks_search_result_id", "search_result_id"),
+    )
+
+# Clicks land on the day of their search, bucketed like the rollups
+_analytics_tz = settings.ANALYTICS_TIMEZONE.replace("'", "''")
+SCHEMA_DDL.append(f"""
+CREATE OR REPLACE FUNCTION count_result_click() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO account_daily_stats (tenant_id, account_id, day, impressions, clicks, position_sum)
+    SELECT l.tenant_id, NEW.account_id, date_trunc('day', l.created_at, '{_analytics_tz}'), 0,
+           CASE WHEN coalesce(NEW.was_clicked, false) THEN 1 ELSE -1 END, 0
+    FROM search_logs l WHERE l.id = NEW.search_log_id
+    ON CONFLICT (tenant_id, account_id, day)
+    DO UPDATE SET clicks = account_daily_stats.clicks + excluded.clicks;
+    INSERT INTO result_clicks (search_result_id, search_log_id, tenant_id, account_id, position, delta, searched_at)
+    SELECT NEW.id, NEW.search_log_id, l.tenant_id, NEW.account_id, NEW.position,
+           CASE WHEN coalesce(NEW.was_clicked, false) THEN 1 ELSE -1 END, l.created_at
+    FROM search_logs l WHERE l.id = NEW.search_log_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+""")
+SCHEMA_DDL.append("DROP TRIGGER IF EXISTS search_results_click_inserts ON search_results")
+SCHEMA_DDL.append("""
+CREATE TRIGGER search_results_click_inserts
+AFTER INSERT ON search_results
+FOR EACH ROW WHEN (NEW.was_clicked) EXECUTE FUNCTION count_result_click()
+""")
+SCHEMA_DDL.append("DROP TRIGGER IF EXISTS search_results_click_updates ON search_results")
+SCHEMA_DDL.append("""
+CREATE TRIGGER search_results_click_updates
+AFTER UPDATE OF was_clicked ON search_results
+FOR EACH ROW WHEN (coalesce(OLD.was_clicked, false) <> coalesce(NEW.was_clicked, false))
+EXECUTE FUNCTION count_result_click()
+""")
+# Clicks from before result_clicks existed
+SCHEMA_DDL.append("""
+INSERT INTO result_clicks (search_result_id, search_log_id, tenant_id, account_id, position, delta, searched_at)
+SELECT r.id, r.search_log_id, l.tenant_id, r.account_id, r.position, 1, l.created_at
+FROM search_results r JOIN search_logs l ON l.id = r.search_log_id
+WHERE r.was_clicked AND NOT EXISTS (SELECT 1 FROM result_clicks c WHERE c.search_result_id = r.id)
+""")
+
+class MrrSnapshot(Base):
+    """Per tenant daily MRR, taken from tenant_counters by app/mrr.py"""
+    __tablename__ = "mrr_snapshots"
+    
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    day: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    mrr_cents: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    active_subscriptions: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    # Running total; churn for a day is the change from the previous snapshot
+    churned_subscriptions: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    taken_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+
+class QuerySketchSnapshot(Base):
+    """Each worker's latest top-query sketches per tenant (see app/heavy_hitters.py)"""
+    __tablename__ = "query_sketch_snapshots"
+    
+    worker_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    tenant_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+    data: Mapped[dict] = mapped_column(JSON, nullable=False)
+    saved_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
 
-    
\ No newline at end of file
+SCHEMA_DDL_VERSION = hashlib.sha1("\n".join(SCHEMA_DDL).encode()).hexdigest()
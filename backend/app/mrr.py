@@ -0,0 +1,48 @@
+# app/mrr.py
+# Daily MRR snapshots from tenant_counters (mrr_cents is kept by the
+# subscriptions trigger, see models.py).
+#
+# Today's row is rewritten on every pass, so once the day is over it holds the
+# last value taken that day. Safe to run on every worker. Run once with
+#   python -m app.mrr snapshot
+import asyncio
+import sys
+
+from sqlalchemy import text
+
+from .db import SessionLocal, settings
+
+SNAPSHOT = text("""
+    INSERT INTO mrr_snapshots (tenant_id, day, mrr_cents, active_subscriptions, churned_subscriptions)
+    SELECT tenant_id, date_trunc('day', now(), :tz),
+           coalesce(sum(value) FILTER (WHERE counter = 'mrr_cents'), 0),
+           coalesce(sum(value) FILTER (WHERE counter = 'active_subscriptions'), 0),
+           coalesce(sum(value) FILTER (WHERE counter = 'churned_subscriptions'), 0)
+    FROM tenant_counters
+    WHERE counter IN ('mrr_cents', 'active_subscriptions', 'churned_subscriptions')
+    GROUP BY tenant_id
+    ON CONFLICT (tenant_id, day) DO UPDATE SET
+        mrr_cents = excluded.mrr_cents,
+        active_subscriptions = excluded.active_subscriptions,
+        churned_subscriptions = excluded.churned_subscriptions,
+        taken_at = now()
+""")
+
+async def take_snapshot():
+    async with SessionLocal() as session:
+        await session.execute(SNAPSHOT, {"tz": settings.ANALYTICS_TIMEZONE})
+        await session.commit()
+
+async def mrr_snapshot_worker():
+    while True:
+        try:
+            await take_snapshot()
+        except Exception as e:
+            print(f"MRR snapshot error: {str(e)}")
+        await asyncio.sleep(settings.MRR_SNAPSHOT_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["snapshot"]:
+        asyncio.run(take_snapshot())
+    else:
+        print("usage: python -m app.mrr snapshot")
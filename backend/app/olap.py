@@ -0,0 +1,220 @@
+# app/olap.py
+# Analytics reports that run either in embedded DuckDB over the exported
+# columnar files (see app/exports.py) or in Postgres.
+#
+# Each report is written once against the logical tables {search_logs},
+# {search_results}, {result_clicks} and {subscription_events}, all carrying a
+# local `date` column and referred to by their own names (no aliases). DuckDB sees the hive-partitioned export directories;
+# Postgres gets equivalent subqueries over the live tables, so both engines
+# return the same rows.
+#
+# Requires duckdb and pyarrow (pip install duckdb pyarrow) for the OLAP path.
+import asyncio
+import os
+import re
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .db import settings
+from .exports import STREAMS, schemas, through_checkpoint
+from .jobs import load_checkpoint
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    duckdb = None
+
+REPORTS = {
+    "daily_searches": """
+        SELECT date AS day, count(*) AS searches,
+               count(*) FILTER (WHERE result_count = 0) AS zero_results,
+               count(DISTINCT lower(trim(search_query))) AS unique_queries
+        FROM {search_logs}
+        WHERE tenant_id = :tenant AND date BETWEEN :start AND :end
+        GROUP BY date ORDER BY date
+    """,
+    # A result counts as clicked when its clicks outnumber its unclicks
+    "ctr_by_position": """
+        SELECT search_results.position, count(*) AS impressions, count(c.search_result_id) AS clicks
+        FROM {search_results}
+        LEFT JOIN (
+            SELECT search_result_id
+            FROM {result_clicks}
+            WHERE tenant_id = :tenant AND date BETWEEN :start AND :end
+            GROUP BY search_result_id HAVING sum(delta) > 0
+        ) c ON c.search_result_id = search_results.id
+        WHERE search_results.tenant_id = :tenant AND search_results.date BETWEEN :start AND :end
+        GROUP BY search_results.position ORDER BY search_results.position
+    """,
+    # Search -> click -> subscription, as /funnel: a clicked account converts
+    # when it has a subscription created within :window of the search
+    "search_funnel": """
+        WITH clicked AS (
+            SELECT search_result_id, search_log_id, account_id, searched_at
+            FROM {result_clicks}
+            WHERE tenant_id = :tenant AND date BETWEEN :start AND :end
+            GROUP BY search_result_id, search_log_id, account_id, searched_at
+            HAVING sum(delta) > 0
+        ),
+        subscribed AS (
+            SELECT account_id, created_at FROM (
+                SELECT account_id, created_at, status,
+                       row_number() OVER (PARTITION BY subscription_id ORDER BY id DESC) AS latest
+                FROM {subscription_events}
+                WHERE tenant_id = :tenant AND date BETWEEN :start AND :window_end
+            ) e
+            WHERE latest = 1 AND status <> 'deleted'
+        )
+        SELECT
+            (SELECT count(*) FROM {search_logs}
+             WHERE tenant_id = :tenant AND date BETWEEN :start AND :end) AS searches,
+            (SELECT count(DISTINCT search_log_id) FROM clicked) AS searches_with_click,
+            (SELECT count(*) FROM clicked) AS clicks,
+            (SELECT count(DISTINCT account_id) FROM clicked) AS clicked_accounts,
+            (SELECT count(DISTINCT c.account_id) FROM clicked c WHERE EXISTS (
+                SELECT 1 FROM subscribed s
+                WHERE s.account_id = c.account_id
+                  AND s.created_at >= c.searched_at AND s.created_at < c.searched_at + :window
+            )) AS converted_accounts
+    """,
+    # Searchers grouped by the week of their first search in the range,
+    # then counted per week since
+    "searcher_cohorts": """
+        SELECT f.cohort, CAST(floor((a.date - f.cohort) / 7.0) AS INTEGER) AS week,
+               count(DISTINCT a.user_id) AS searchers
+        FROM (
+            SELECT user_id, CAST(date_trunc('week', min(date)) AS DATE) AS cohort
+            FROM {search_logs}
+            WHERE tenant_id = :tenant AND user_id IS NOT NULL AND date BETWEEN :start AND :end
+            GROUP BY user_id
+        ) f
+        JOIN (
+            SELECT DISTINCT user_id, date
+            FROM {search_logs}
+            WHERE tenant_id = :tenant AND user_id IS NOT NULL AND date BETWEEN :start AND :end
+        ) a ON a.user_id = f.user_id
+        GROUP BY f.cohort, week ORDER BY f.cohort, week
+    """,
+}
+
+# Postgres stand-ins for the exported tables; the created_at bounds keep the
+# tenant/created_at index usable. The click and subscription logs are read
+# from their current state: one +1 row per clicked result, one row per subscription.
+POSTGRES_TABLES = {
+    "search_logs": """(
+        SELECT id, tenant_id, search_query, result_count, user_id, created_at, txid,
+               (created_at AT TIME ZONE :tz)::date AS date
+        FROM search_logs
+        WHERE created_at >= :since AND created_at < :until
+    ) search_logs""",
+    "search_results": """(
+        SELECT r.id, r.search_log_id, l.tenant_id, r.account_id, r.position, r.score,
+               l.created_at AS searched_at, (l.created_at AT TIME ZONE :tz)::date AS date
+        FROM search_results r JOIN search_logs l ON l.id = r.search_log_id
+        WHERE l.created_at >= :since AND l.created_at < :until
+    ) search_results""",
+    "result_clicks": """(
+        SELECT r.id AS search_result_id, r.search_log_id, l.tenant_id, r.account_id, r.position,
+               1 AS delta, l.created_at AS searched_at, (l.created_at AT TIME ZONE :tz)::date AS date
+        FROM search_results r JOIN search_logs l ON l.id = r.search_log_id
+        WHERE r.was_clicked AND l.created_at >= :since AND l.created_at < :until
+    ) result_clicks""",
+    "subscription_events": """(
+        SELECT 0 AS id, id AS subscription_id, tenant_id, account_id, status, amount_cents, created_at,
+               (created_at AT TIME ZONE :tz)::date AS date
+        FROM subscriptions
+        WHERE created_at >= :since AND created_at < :window_until
+    ) subscription_events""",
+}
+
+# ":name" binds, but not the second colon of a "::" cast
+PARAM = re.compile(r"(?<!:):(\w+)")
+
+def olap_available() -> bool:
+    return duckdb is not None and bool(settings.ANALYTICS_EXPORT_DIR)
+
+async def exported_through(session: AsyncSession) -> Optional[datetime]:
+    """Everything stamped before this is on disk in every stream; only advanced when the exporter caught up"""
+    bounds = []
+    for stream in STREAMS:
+        position = await load_checkpoint(session, through_checkpoint(stream))
+        if not position:
+            return None
+        bounds.append(datetime.fromisoformat(position))
+    return min(bounds)
+
+def _dataset(name: str):
+    path = os.path.join(settings.ANALYTICS_EXPORT_DIR, name)
+    if not os.path.isdir(path):
+        # Nothing exported yet for this table
+        return schemas()[name].append(pa.field("date", pa.date32())).empty_table()
+    fmt = "ipc" if settings.EXPORT_FORMAT == "arrow" else "parquet"
+    partitioning = ds.partitioning(pa.schema([("date", pa.date32())]), flavor="hive")
+    return ds.dataset(path, format=fmt, partitioning=partitioning)
+
+def _run_duckdb(sql: str, params: dict):
+    con = duckdb.connect()
+    try:
+        for name in POSTGRES_TABLES:
+            # Arrow datasets are scanned lazily with projection/filter pushdown
+            con.register(name, _dataset(name))
+        cursor = con.execute(PARAM.sub(r"$\1", sql), params)
+        columns = [d[0] for d in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        con.close()
+
+async def run_report(
+    session: AsyncSession, report: str, tenant_id: uuid.UUID, start: date, end: date, engine: str,
+    window_days: int = 7,
+) -> dict:
+    tz = ZoneInfo(settings.ANALYTICS_TIMEZONE)
+    template = REPORTS[report]
+    through = await exported_through(session)
+    after = end + timedelta(days=1)
+    range_end = datetime(after.year, after.month, after.day, tzinfo=tz)
+    window = timedelta(days=window_days)
+    # Windowed reports also read subscriptions up to a window past the range
+    data_end = range_end + window if ":window" in template else range_end
+
+    if engine == "auto":
+        # Files only cover what the exporter has reached
+        fresh = through is not None and data_end <= through
+        engine = "olap" if olap_available() and fresh else "sql"
+
+    if engine == "olap" and not olap_available():
+        raise RuntimeError("OLAP mode needs duckdb, pyarrow and ANALYTICS_EXPORT_DIR")
+
+    params = {"tenant": tenant_id, "start": start, "end": end, "window": window, "window_end": end + window}
+    if engine == "olap":
+        sql = template.format(**{name: name for name in POSTGRES_TABLES})
+        params["tenant"] = str(tenant_id)
+    else:
+        sql = template.format(**POSTGRES_TABLES)
+        params.update(
+            tz=settings.ANALYTICS_TIMEZONE,
+            since=datetime(start.year, start.month, start.day, tzinfo=tz),
+            until=range_end,
+            window_until=data_end,
+        )
+    used = set(PARAM.findall(sql))
+    params = {k: v for k, v in params.items() if k in used}
+    if engine == "olap":
+        rows = await asyncio.to_thread(_run_duckdb, sql, params)
+    else:
+        result = await session.execute(text(sql), params)
+        rows = [dict(row._mapping) for row in result.all()]
+
+    return {
+        "report": report,
+        "engine": engine,
+        "exported_through": through.isoformat() if through else None,
+        "rows": rows,
+    }
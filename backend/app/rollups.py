@@ -0,0 +1,188 @@
+# app/rollups.py
+# Incremental hourly/daily search rollups, per-account impressions and daily
+# HyperLogLog sketches.
+#
+# The aggregator folds search_logs rows into search_rollups past a txid
+# watermark. Rows are only taken below the oldest running transaction, so a
+# search that commits late is still picked up on a later pass.
+import asyncio
+from typing import Optional
+
+from sqlalchemy import select, text, bindparam, tuple_, BigInteger, String
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .db import SessionLocal, settings
+from .hll import HyperLogLog
+from .jobs import load_checkpoint, save_checkpoint
+from .models import SearchSketch
+
+CHECKPOINT = "search_rollups"
+# Any constant works; it only has to be unique among our advisory locks
+LOCK_KEY = 7_301_001
+
+# Shared bucketing for every statement below
+BUCKETS = """
+    SELECT tenant_id, 'hour' AS granularity, date_trunc('hour', created_at, 'UTC') AS bucket,
+           result_count, md5(lower(btrim(search_query)))::uuid AS query_hash
+    FROM search_logs WHERE txid > :lo AND txid <= :hi
+    UNION ALL
+    SELECT tenant_id, 'day', date_trunc('day', created_at, :tz),
+           result_count, md5(lower(btrim(search_query)))::uuid
+    FROM search_logs WHERE txid > :lo AND txid <= :hi
+"""
+
+NEXT_BATCH = text("""
+    SELECT max(txid) FROM (
+        SELECT txid FROM search_logs
+        WHERE txid > :lo AND txid < txid_snapshot_xmin(txid_current_snapshot())
+        ORDER BY txid LIMIT :batch_size
+    ) batch
+""")
+
+ADD_COUNTS = text(f"""
+    INSERT INTO search_rollups (tenant_id, granularity, bucket, searches, zero_results, unique_queries)
+    SELECT tenant_id, granularity, bucket, count(*), count(*) FILTER (WHERE result_count = 0), 0
+    FROM ({BUCKETS}) b
+    GROUP BY tenant_id, granularity, bucket
+    ON CONFLICT (tenant_id, granularity, bucket) DO UPDATE SET
+        searches = search_rollups.searches + excluded.searches,
+        zero_results = search_rollups.zero_results + excluded.zero_results
+""")
+
+# Only queries not seen before in a bucket raise its unique_queries
+ADD_UNIQUE_QUERIES = text(f"""
+    WITH fresh AS (
+        INSERT INTO search_rollup_queries (tenant_id, granularity, bucket, query_hash)
+        SELECT DISTINCT tenant_id, granularity, bucket, query_hash FROM ({BUCKETS}) b
+        ON CONFLICT DO NOTHING
+        RETURNING tenant_id, granularity, bucket
+    )
+    UPDATE search_rollups r SET unique_queries = r.unique_queries + f.n
+    FROM (SELECT tenant_id, granularity, bucket, count(*) AS n FROM fresh
+          GROUP BY tenant_id, granularity, bucket) f
+    WHERE r.tenant_id = f.tenant_id AND r.granularity = f.granularity AND r.bucket = f.bucket
+""")
+
+# Impressions per account and day; clicks are kept by a trigger (see AccountDailyStat)
+ADD_ACCOUNT_IMPRESSIONS = text("""
+    INSERT INTO account_daily_stats (tenant_id, account_id, day, impressions, clicks, position_sum)
+    SELECT l.tenant_id, r.account_id, date_trunc('day', l.created_at, :tz), count(*), 0, sum(r.position)
+    FROM search_logs l JOIN search_results r ON r.search_log_id = l.id
+    WHERE l.txid > :lo AND l.txid <= :hi
+    GROUP BY 1, 2, 3
+    ON CONFLICT (tenant_id, account_id, day) DO UPDATE SET
+        impressions = account_daily_stats.impressions + excluded.impressions,
+        position_sum = account_daily_stats.position_sum + excluded.position_sum
+""")
+
+# Closed buckets no longer need their seen-query sets
+PRUNE_QUERIES = text("""
+    DELETE FROM search_rollup_queries
+    WHERE bucket < date_trunc('day', now(), :tz) - interval '1 day'
+""")
+
+# Distinct sketch inputs for the batch: 's' = searcher, 'q' = normalized query
+SKETCH_INPUTS = text("""
+    SELECT DISTINCT tenant_id, date_trunc('day', created_at, :tz) AS day, 's' AS kind, user_id::text AS value
+    FROM search_logs WHERE txid > :lo AND txid <= :hi AND user_id IS NOT NULL
+    UNION
+    SELECT DISTINCT tenant_id, date_trunc('day', created_at, :tz), 'q', md5(lower(btrim(search_query)))
+    FROM search_logs WHERE txid > :lo AND txid <= :hi
+""")
+
+# Same inputs for one tenant's logs in [since, until) the aggregator hasn't
+# reached yet, oldest first and at most :limit of them (see /searches/unique)
+PENDING_SKETCH_INPUTS = text("""
+    WITH pending AS (
+        SELECT tenant_id, created_at, user_id, search_query FROM search_logs
+        WHERE txid > :lo AND tenant_id = :tenant AND created_at >= :since AND created_at < :until
+        ORDER BY txid LIMIT :limit
+    )
+    SELECT DISTINCT tenant_id, date_trunc('day', created_at, :tz) AS day, 's' AS kind, user_id::text AS value
+    FROM pending WHERE user_id IS NOT NULL
+    UNION
+    SELECT DISTINCT tenant_id, date_trunc('day', created_at, :tz), 'q', md5(lower(btrim(search_query)))
+    FROM pending
+""").bindparams(bindparam("lo", type_=BigInteger), bindparam("tz", type_=String))
+
+def _bind(stmt):
+    return stmt.bindparams(
+        bindparam("lo", type_=BigInteger),
+        bindparam("hi", type_=BigInteger),
+        bindparam("tz", type_=String),
+    )
+
+ADD_COUNTS = _bind(ADD_COUNTS)
+ADD_UNIQUE_QUERIES = _bind(ADD_UNIQUE_QUERIES)
+ADD_ACCOUNT_IMPRESSIONS = _bind(ADD_ACCOUNT_IMPRESSIONS)
+SKETCH_INPUTS = _bind(SKETCH_INPUTS)
+
+def add_to_sketches(sketches: dict, rows):
+    """Fold (tenant_id, day, kind, value) rows into {(tenant_id, day): (searchers, queries)}"""
+    for tenant_id, day, kind, value in rows:
+        pair = sketches.get((tenant_id, day))
+        if pair is None:
+            pair = sketches[(tenant_id, day)] = (HyperLogLog(), HyperLogLog())
+        pair[0 if kind == "s" else 1].add(value)
+
+async def update_sketches(session, params: dict):
+    rows = (await session.execute(SKETCH_INPUTS, params)).all()
+    if not rows:
+        return
+    fresh = {}
+    add_to_sketches(fresh, rows)
+    
+    # Merge into the stored sketches for the touched days
+    stored = await session.execute(
+        select(SearchSketch).where(tuple_(SearchSketch.tenant_id, SearchSketch.day).in_(list(fresh)))
+    )
+    for sketch in stored.scalars().all():
+        searchers, queries = fresh[(sketch.tenant_id, sketch.day)]
+        searchers.merge(HyperLogLog.from_bytes(sketch.searchers))
+        queries.merge(HyperLogLog.from_bytes(sketch.queries))
+    
+    stmt = pg_insert(SearchSketch).values([
+        {"tenant_id": tenant_id, "day": day, "searchers": s.to_bytes(), "queries": q.to_bytes()}
+        for (tenant_id, day), (s, q) in fresh.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SearchSketch.tenant_id, SearchSketch.day],
+        set_={"searchers": stmt.excluded.searchers, "queries": stmt.excluded.queries},
+    )
+    await session.execute(stmt)
+
+async def rollup_batch(batch_size: int) -> Optional[int]:
+    """Fold the next batch of logs into the rollups; returns the new watermark, or None when idle"""
+    async with SessionLocal() as session:
+        # One aggregator at a time across workers, or counts would double
+        locked = await session.scalar(text(f"SELECT pg_try_advisory_xact_lock({LOCK_KEY})"))
+        if not locked:
+            return None
+        lo = int(await load_checkpoint(session, CHECKPOINT) or 0)
+        hi = await session.scalar(NEXT_BATCH, {"lo": lo, "batch_size": batch_size})
+        if hi is None:
+            return None
+
+        params = {"lo": lo, "hi": hi, "tz": settings.ANALYTICS_TIMEZONE}
+        await session.execute(ADD_COUNTS, params)
+        await session.execute(ADD_UNIQUE_QUERIES, params)
+        await session.execute(ADD_ACCOUNT_IMPRESSIONS, params)
+        await update_sketches(session, params)
+        await save_checkpoint(session, CHECKPOINT, str(hi))
+        await session.commit()
+        return hi
+
+async def catch_up():
+    while await rollup_batch(settings.ROLLUP_BATCH_SIZE) is not None:
+        await asyncio.sleep(0)
+    async with SessionLocal() as session:
+        await session.execute(PRUNE_QUERIES, {"tz": settings.ANALYTICS_TIMEZONE})
+        await session.commit()
+
+async def rollup_worker():
+    while True:
+        try:
+            await catch_up()
+        except Exception as e:
+            print(f"Search rollup error: {str(e)}")
+        await asyncio.sleep(settings.ROLLUP_INTERVAL_SECONDS)
@@ -1,82 +1,390 @@
 # app/routers/accounts.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import select, insert, update, any_, bindparam, or_, literal_column
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID as PG_UUID, insert as pg_insert
+from typing import List, Optional
+import hashlib
+import json
+import time
 import uuid
 
-from ..db import get_session
+from ..db import get_session, settings, SessionLocal
+from ..cache import account_cache, invalidate_account, invalidate_accounts
+from .. import live
+from ..fieldsets import parse_fields, dump_fields, to_json
+from ..counters import get_tenant_counters
+from ..changefeed import START, parse_offset, read_changes, wait_for_changes
 from ..models import Account, Subscription, Category
-from ..schemas import AccountResponse, AccountCreate, AccountUpdate
+from ..schemas import (
+    AccountResponse, AccountCreate, AccountUpdate,
+    AccountBatchRequest, AccountBatchResponse,
+    AccountUpsertRequest, AccountUpsertResponse,
+)
 
 router = APIRouter(prefix="/api/accounts", tags=["accounts"])
 
+# Fields that ?fields= may select, mapped to their accounts columns
+ACCOUNT_COLUMNS = {
+    name: Account.__table__.c[name]
+    for name in AccountResponse.model_fields
+    if name in Account.__table__.c
+}
+
+def field_columns(selected: List[str]):
+    # id and version are always read so ETags can be computed
+    names = dict.fromkeys(["id", "version", *selected])
+    return [ACCOUNT_COLUMNS[name] for name in names]
+
+# ETag helpers
+def account_etag(version: int, selected: Optional[List[str]] = None) -> str:
+    # Sparse representations get their own strong validator
+    if selected is not None:
+        return f'"{version};{",".join(selected)}"'
+    return f'"{version}"'
+
+def list_etag(versions, selected: Optional[List[str]] = None) -> str:
+    # versions: (id, version) pairs for the page, in response order
+    key = ",".join(f"{id}:{v}" for id, v in versions)
+    if selected is not None:
+        key += ";" + ",".join(selected)
+    return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+def if_match_versions(if_match: str) -> Optional[List[int]]:
+    """Versions accepted by an If-Match header, or None for "*" (any)"""
+    if if_match.strip() == "*":
+        return None
+    versions = []
+    # If-Match uses strong comparison, so weak tags never match
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith('"') and tag.endswith('"') and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
 @router.get("/", response_model=List[AccountResponse])
 async def list_accounts(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     session: AsyncSession = Depends(get_session)
 ):
     """List all business accounts"""
-    query = select(Account).where(
-        Account.tenant_id == uuid.UUID("11111111-1111-1111-1111-111111111111")
-    ).offset(skip).limit(limit)
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    selected = parse_fields(fields, ACCOUNT_COLUMNS)
+    page = select(Account).where(
+        Account.tenant_id == tenant_id
+    ).order_by(Account.id).offset(skip).limit(limit)
     
-    result = await session.execute(query)
+    if if_none_match:
+        # Probe only ids and versions for the page before loading full rows
+        probe = page.with_only_columns(Account.id, Account.version)
+        etag = list_etag((await session.execute(probe)).all(), selected)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    
+    # Exact total from the maintained counter instead of COUNT(*)
+    counters = await get_tenant_counters(session, tenant_id)
+    total = str(counters["accounts"])
+    response.headers["X-Total-Count"] = total
+    
+    if selected is not None:
+        # Only the requested columns leave the database
+        rows = (await session.execute(page.with_only_columns(*field_columns(selected)))).all()
+        etag = list_etag(((r.id, r.version) for r in rows), selected)
+        return Response(
+            content=to_json([dump_fields(r, selected) for r in rows]),
+            media_type="application/json",
+            headers={"ETag": etag, "X-Total-Count": total},
+        )
+    
+    result = await session.execute(page)
     accounts = result.scalars().all()
     
+    response.headers["ETag"] = list_etag((a.id, a.version) for a in accounts)
     return accounts
 
+@router.post("/batch", response_model=AccountBatchResponse)
+async def batch_get_accounts(
+    request: AccountBatchRequest,
+    session: AsyncSession = Depends(get_session)
+):
+    """Get many business accounts in one query, in request order"""
+    # Dedupe while keeping order; the whole list goes over as one array param
+    unique_ids = list(dict.fromkeys(request.ids))
+    query = select(Account).where(
+        Account.tenant_id == uuid.UUID("11111111-1111-1111-1111-111111111111"),
+        Account.id == any_(bindparam("ids", unique_ids, type_=ARRAY(PG_UUID(as_uuid=True))))
+    )
+    result = await session.execute(query)
+    found = {account.id: account for account in result.scalars().all()}
+    
+    return {
+        "results": [found.get(account_id) for account_id in request.ids],
+        "missing": [account_id for account_id in unique_ids if account_id not in found],
+    }
+
+@router.post("/upsert", response_model=AccountUpsertResponse)
+async def upsert_accounts(
+    request: AccountUpsertRequest,
+    session: AsyncSession = Depends(get_session)
+):
+    """Idempotently insert or update accounts keyed on email address"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    
+    # ON CONFLICT cannot touch the same row twice in one statement, so dedupe
+    rows = {}
+    for account in request.accounts:
+        rows[account.email_address] = {"tenant_id": tenant_id, **account.dict()}
+    rows = list(rows.values())
+    
+    fields = [name for name in AccountCreate.model_fields if name != "email_address"]
+    inserted = updated = 0
+    changed_ids = []
+    batch_size = settings.ACCOUNT_UPSERT_BATCH_SIZE
+    
+    for start in range(0, len(rows), batch_size):
+        stmt = pg_insert(Account).values(rows[start:start + batch_size])
+        excluded = stmt.excluded
+        # Skip the write entirely when nothing differs; json has no equality
+        # operator, so attributes is compared as jsonb
+        differs = [
+            Account.attributes.cast(JSONB).is_distinct_from(excluded.attributes.cast(JSONB))
+            if name == "attributes"
+            else getattr(Account, name).is_distinct_from(getattr(excluded, name))
+            for name in fields
+        ]
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Account.tenant_id, Account.email_address],
+            set_={
+                **{name: getattr(excluded, name) for name in fields},
+                "version": Account.version + 1,
+            },
+            where=or_(*differs),
+        ).returning(Account.id, literal_column("xmax = 0").label("inserted"))
+        
+        # Unchanged rows are filtered by the WHERE and return nothing
+        for row in (await session.execute(stmt)).all():
+            if row.inserted:
+                inserted += 1
+            else:
+                updated += 1
+                changed_ids.append(row.id)
+    
+    await session.commit()
+    await invalidate_accounts(changed_ids)
+    if inserted:
+        live.record(tenant_id, "total_businesses", inserted)
+    
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": len(rows) - inserted - updated,
+    }
+
+def checked_offset(offset: Optional[str]) -> str:
+    try:
+        parse_offset(offset)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid change feed offset")
+    return offset or START
+
+@router.get("/changes")
+async def account_changes(
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=30, description="Seconds to long-poll when no changes are pending"),
+    session: AsyncSession = Depends(get_session)
+):
+    """Account change events after an offset, oldest first"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    after = checked_offset(after)
+    deadline = time.monotonic() + wait
+    
+    events = await read_changes(session, after, limit, tenant_id)
+    while not events and time.monotonic() < deadline:
+        # Don't hold a transaction open while waiting
+        await session.commit()
+        await wait_for_changes(min(deadline - time.monotonic(), settings.CHANGEFEED_POLL_SECONDS))
+        events = await read_changes(session, after, limit, tenant_id)
+    
+    return {
+        "events": events,
+        "next": events[-1]["offset"] if events else after,
+    }
+
+@router.get("/changes/stream")
+async def stream_account_changes(
+    request: Request,
+    after: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    """Server-Sent Events stream of account changes; resumes from Last-Event-ID"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    offset = checked_offset(last_event_id or after)
+    
+    async def events():
+        nonlocal offset
+        while not await request.is_disconnected():
+            # Short-lived session per poll so idle streams hold no connection
+            async with SessionLocal() as session:
+                batch = await read_changes(session, offset, settings.CHANGEFEED_BATCH_SIZE, tenant_id)
+            for event in batch:
+                offset = event["offset"]
+                yield f"id: {offset}\nevent: change\ndata: {json.dumps(event)}\n\n"
+            if not batch:
+                yield ": keepalive\n\n"
+                await wait_for_changes(settings.CHANGEFEED_POLL_SECONDS)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @router.get("/{account_id}", response_model=AccountResponse)
 async def get_account(
     account_id: uuid.UUID,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     session: AsyncSession = Depends(get_session)
 ):
     """Get a specific business account"""
-    query = select(Account).where(Account.id == account_id)
-    result = await session.execute(query)
-    account = result.scalar_one_or_none()
+    selected = parse_fields(fields, ACCOUNT_COLUMNS)
+    
+    # Read-through cache of (version, serialized full response)
+    cached = account_cache.get(account_id)
+    if cached is None and if_none_match:
+        # Version-only lookup served from ix_accounts_id_version
+        version = await session.scalar(
+            select(Account.version).where(Account.id == account_id)
+        )
+        if version is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+        if etag_matches(if_none_match, account_etag(version, selected)):
+            return not_modified(account_etag(version, selected))
     
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found")
+    if cached is None and selected is not None:
+        # Sparse miss: read just the requested columns, leave the cache alone
+        query = select(*field_columns(selected)).where(Account.id == account_id)
+        row = (await session.execute(query)).one_or_none()
+        if not row:
+            raise HTTPException(status_code=404, detail="Account not found")
+        version, payload = row.version, to_json(dump_fields(row, selected))
+    else:
+        if cached is None:
+            token = account_cache.fill_token()
+            query = select(Account).where(Account.id == account_id)
+            result = await session.execute(query)
+            account = result.scalar_one_or_none()
+            
+            if not account:
+                raise HTTPException(status_code=404, detail="Account not found")
+            
+            payload = AccountResponse.model_validate(account).model_dump_json().encode()
+            cached = (account.version, payload)
+            # Skipped if the account was invalidated while we were reading it
+            account_cache.set_if_fresh(account_id, cached, token)
+        
+        version, payload = cached
+        if selected is not None:
+            full = json.loads(payload)
+            payload = to_json({name: full[name] for name in selected})
     
-    return account
+    etag = account_etag(version, selected)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    return Response(content=payload, media_type="application/json", headers={"ETag": etag})
 
 @router.post("/", response_model=AccountResponse)
 async def create_account(
     account: AccountCreate,
+    response: Response,
     session: AsyncSession = Depends(get_session)
 ):
     """Create a new business account"""
-    db_account = Account(
+    # INSERT ... RETURNING gives back the stored row, no refresh needed
+    stmt = insert(Account).values(
         tenant_id=uuid.UUID("11111111-1111-1111-1111-111111111111"),
         **account.dict()
-    )
-    session.add(db_account)
+    ).returning(*Account.__table__.c)
+    try:
+        result = await session.execute(stmt)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="An account with this email already exists")
+    row = result.one()
     await session.commit()
-    await session.refresh(db_account)
+    await invalidate_account(row.id)
+    live.record(row.tenant_id, "total_businesses")
     
-    return db_account
+    response.headers["ETag"] = account_etag(row.version)
+    return AccountResponse.model_validate(row)
 
 @router.patch("/{account_id}", response_model=AccountResponse)
 async def update_account(
     account_id: uuid.UUID,
     updates: AccountUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     session: AsyncSession = Depends(get_session)
 ):
-    """Update a business account"""
-    query = select(Account).where(Account.id == account_id)
-    result = await session.execute(query)
-    account = result.scalar_one_or_none()
+    """Update a business account, optionally conditional on If-Match"""
+    conditions = [Account.id == account_id]
+    expected = if_match_versions(if_match) if if_match else None
+    if expected is not None:
+        conditions.append(Account.version.in_(expected))
     
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found")
+    changes = updates.dict(exclude_unset=True)
+    if not changes:
+        # Nothing to write, just return the current row
+        query = select(Account).where(Account.id == account_id)
+        account = (await session.execute(query)).scalar_one_or_none()
+        if not account:
+            raise HTTPException(status_code=404, detail="Account not found")
+        if expected is not None and account.version not in expected:
+            raise HTTPException(
+                status_code=412,
+                detail="Account was modified",
+                headers={"ETag": account_etag(account.version)},
+            )
+        response.headers["ETag"] = account_etag(account.version)
+        return account
     
-    for key, value in updates.dict(exclude_unset=True).items():
-        setattr(account, key, value)
+    # Single conditional UPDATE ... RETURNING: the version check and the write
+    # happen atomically, so concurrent writers cannot overwrite each other
+    stmt = update(Account).where(
+        *conditions
+    ).values(**changes, version=Account.version + 1).returning(*Account.__table__.c)
+    result = await session.execute(stmt)
+    row = result.one_or_none()
+    
+    if not row:
+        # Only the failure path pays for telling a miss from a conflict
+        current = await session.scalar(
+            select(Account.version).where(Account.id == account_id)
+        )
+        if current is None:
+            raise HTTPException(status_code=404, detail="Account not found")
+        raise HTTPException(
+            status_code=412,
+            detail="Account was modified",
+            headers={"ETag": account_etag(current)},
+        )
     
     await session.commit()
-    await session.refresh(account)
+    await invalidate_account(account_id)
     
-    return account
-
+    response.headers["ETag"] = account_etag(row.version)
+    return AccountResponse.model_validate(row)
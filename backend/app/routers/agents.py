@@ -1,154 +1,267 @@
 # app/routers/agents.py
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
-from openai import OpenAI
+from openai import AsyncOpenAI
+import asyncio
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
 
+from ..db import settings
+from ..cache import TTLCache, DiskCache, TieredCache
+
 # Load environment variables FIRST
 load_dotenv()
 
 router = APIRouter(prefix="/agents", tags=["agents"])
 
 # Initialize OpenAI client - it will be None if no key is found
+# Async client: a slow generation must not block the event loop for other requests
 api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key) if api_key else None
+client = AsyncOpenAI(api_key=api_key, timeout=settings.AGENT_TIMEOUT_SECONDS) if api_key else None
+
+# Caps in-flight provider calls per worker; extra requests wait their turn
+llm_slots = asyncio.Semaphore(settings.AGENT_MAX_CONCURRENCY)
+
+# Completed generations keyed by a hash of the exact completion request.
+# Only the templated tools use it: free-form chat is conversational and an
+# identical prompt should still get a fresh answer.
+response_cache = TieredCache(
+    TTLCache(max_entries=settings.AGENT_CACHE_MAX_ENTRIES, ttl_seconds=settings.AGENT_CACHE_TTL_SECONDS),
+    DiskCache(settings.AGENT_CACHE_DIR, settings.AGENT_CACHE_TTL_SECONDS, settings.AGENT_CACHE_DIR_MAX_ENTRIES)
+    if settings.AGENT_CACHE_DIR else None,
+)
 
 class AgentRequest(BaseModel):
     prompt: str
     model: Optional[str] = "gpt-3.5-turbo"
     history: Optional[List[dict]] = []
+    # Set to false to skip the response cache of the templated tools (nothing is read or stored)
+    cache: Optional[bool] = True
 
 class AgentResponse(BaseModel):
     content: str
     model: str
+    cached: Optional[bool] = False
 
-@router.post("/chat", response_model=AgentResponse)
-async def chat_agent(request: AgentRequest):
+BUSINESS_PROMPTS = {
+    "name": "Generate 5 creative business names for: {}",
+    "plan": "Create a brief business plan outline for: {}",
+    "pitch": "Write a 30-second elevator pitch for: {}",
+    "slogan": "Generate 5 catchy slogans for: {}",
+    "mission": "Write a mission statement for: {}"
+}
+
+EMAIL_TEMPLATES = {
+    "sales": "Write a professional sales email",
+    "welcome": "Write a warm welcome email",
+    "followup": "Write a follow-up email",
+    "apology": "Write a sincere apology email",
+    "newsletter": "Write an engaging newsletter email"
+}
+
+SOCIAL_PLATFORMS = {
+    "twitter": "Write a Twitter/X post (max 280 characters)",
+    "linkedin": "Write a professional LinkedIn post",
+    "instagram": "Write an Instagram caption with relevant hashtags",
+    "facebook": "Write a Facebook post",
+    "tiktok": "Write a TikTok video caption with trending hashtags"
+}
+
+BRAND_TYPES = {
+    "slogan": "Create a brand slogan",
+    "tagline": "Create a brand tagline",
+    "mission": "Write a brand mission statement",
+    "values": "Define brand values",
+    "story": "Write a brand story"
+}
+
+def check_client():
+    if not client or not api_key:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured. Please set OPENAI_API_KEY in .env file")
+
+def build_completion(request: AgentRequest) -> dict:
+    """Arguments for chat.completions.create"""
+    # Build messages for OpenAI
+    messages = [{"role": "system", "content": "You are a helpful AI assistant."}]
+
+    # Add history if provided
+    for msg in request.history[-10:]:  # Last 10 messages
+        role = "user" if msg.get("role") == "user" else "assistant"
+        messages.append({"role": role, "content": msg.get("content", "")})
+
+    # Add current prompt
+    messages.append({"role": "user", "content": request.prompt})
+
+    return {
+        "model": request.model if request.model != "claude" else "gpt-3.5-turbo",
+        "messages": messages,
+        "max_tokens": 1000,
+        "temperature": 0.7,
+    }
+
+def cache_key(completion: dict) -> str:
+    """Content address of a completion request: model, full message list and parameters"""
+    return hashlib.sha256(json.dumps(completion, sort_keys=True).encode()).hexdigest()
+
+def use_cache(request: AgentRequest, cacheable: bool) -> bool:
+    return cacheable and settings.AGENT_CACHE_ENABLED and request.cache is not False
+
+def business_request(tool_type: str, request: AgentRequest) -> AgentRequest:
+    if tool_type not in BUSINESS_PROMPTS:
+        raise HTTPException(status_code=400, detail="Invalid business tool type")
+    return AgentRequest(prompt=BUSINESS_PROMPTS[tool_type].format(request.prompt), model=request.model, cache=request.cache)
+
+def email_request(email_type: str, request: AgentRequest) -> AgentRequest:
+    if email_type not in EMAIL_TEMPLATES:
+        raise HTTPException(status_code=400, detail="Invalid email type")
+    return AgentRequest(prompt=f"{EMAIL_TEMPLATES[email_type]} based on: {request.prompt}", model=request.model, cache=request.cache)
+
+def social_request(platform: str, request: AgentRequest) -> AgentRequest:
+    if platform not in SOCIAL_PLATFORMS:
+        raise HTTPException(status_code=400, detail="Invalid platform")
+    return AgentRequest(prompt=f"{SOCIAL_PLATFORMS[platform]} about: {request.prompt}", model=request.model, cache=request.cache)
+
+def blog_post_request(request: AgentRequest) -> AgentRequest:
+    return AgentRequest(prompt=f"Write a blog post about: {request.prompt}", model=request.model, cache=request.cache)
+
+def blog_outline_request(request: AgentRequest) -> AgentRequest:
+    return AgentRequest(prompt=f"Create a detailed blog post outline for: {request.prompt}", model=request.model, cache=request.cache)
+
+def brand_request(brand_type: str, request: AgentRequest) -> AgentRequest:
+    if brand_type not in BRAND_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid brand content type")
+    return AgentRequest(prompt=f"{BRAND_TYPES[brand_type]} for: {request.prompt}", model=request.model, cache=request.cache)
+
+async def generate(request: AgentRequest, cacheable: bool = False) -> AgentResponse:
     try:
-        if not client or not api_key:
-            raise HTTPException(status_code=500, detail="OpenAI API key not configured. Please set OPENAI_API_KEY in .env file")
-        
-        # Build messages for OpenAI
-        messages = [{"role": "system", "content": "You are a helpful AI assistant."}]
-        
-        # Add history if provided
-        for msg in request.history[-10:]:  # Last 10 messages
-            role = "user" if msg.get("role") == "user" else "assistant"
-            messages.append({"role": role, "content": msg.get("content", "")})
-        
-        # Add current prompt
-        messages.append({"role": "user", "content": request.prompt})
-        
+        check_client()
+        completion = build_completion(request)
+        key = cache_key(completion)
+        if use_cache(request, cacheable):
+            cached = await response_cache.get(key)
+            if cached is not None:
+                return AgentResponse(content=cached, model=request.model, cached=True)
+
         # Call OpenAI with new client
-        response = client.chat.completions.create(
-            model=request.model if request.model != "claude" else "gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.7
-        )
-        
+        async with llm_slots:
+            response = await client.chat.completions.create(**completion)
+
         content = response.choices[0].message.content
-        
+        if use_cache(request, cacheable) and content and response.choices[0].finish_reason == "stop":
+            # Truncated or filtered answers aren't worth repeating
+            await response_cache.set(key, content)
+
         return AgentResponse(
             content=content,
             model=request.model
         )
-    
+
     except Exception as e:
         print(f"OpenAI API Error: {str(e)}")  # This will show in your backend console
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat", response_model=AgentResponse)
+async def chat_agent(request: AgentRequest):
+    return await generate(request)
+
+def stream_agent(request: AgentRequest, cacheable: bool = False) -> StreamingResponse:
+    """Server-Sent Events: `token` events as the model writes, then `done` (or `error`).
+
+    The generator is only advanced as fast as the client reads, so a slow
+    reader also slows how fast we read from the provider. When the client
+    disconnects, Starlette cancels the generator and the finally block closes
+    the provider stream, which stops the generation.
+    """
+    check_client()
+    completion = build_completion(request)
+    key = cache_key(completion)
+
+    async def events():
+        stream = None
+        try:
+            cached = await response_cache.get(key) if use_cache(request, cacheable) else None
+            if cached is not None:
+                # Replay in one event
+                yield f"event: token\ndata: {json.dumps({'content': cached})}\n\n"
+                yield f"event: done\ndata: {json.dumps({'model': request.model, 'cached': True})}\n\n"
+                return
+            parts = []
+            finish_reason = None
+            async with llm_slots:
+                stream = await client.chat.completions.create(**completion, stream=True)
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    if content:
+                        parts.append(content)
+                        yield f"event: token\ndata: {json.dumps({'content': content})}\n\n"
+            # Only complete generations are cached; a disconnect never gets here
+            if use_cache(request, cacheable) and parts and finish_reason == "stop":
+                await response_cache.set(key, "".join(parts))
+            yield f"event: done\ndata: {json.dumps({'model': request.model})}\n\n"
+        except Exception as e:
+            print(f"OpenAI API Error: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        finally:
+            if stream is not None:
+                await stream.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@router.post("/chat/stream")
+async def chat_agent_stream(request: AgentRequest):
+    return stream_agent(request)
+
 @router.post("/business/{tool_type}", response_model=AgentResponse)
 async def business_agent(tool_type: str, request: AgentRequest):
-    prompts = {
-        "name": f"Generate 5 creative business names for: {request.prompt}",
-        "plan": f"Create a brief business plan outline for: {request.prompt}",
-        "pitch": f"Write a 30-second elevator pitch for: {request.prompt}",
-        "slogan": f"Generate 5 catchy slogans for: {request.prompt}",
-        "mission": f"Write a mission statement for: {request.prompt}"
-    }
-    
-    if tool_type not in prompts:
-        raise HTTPException(status_code=400, detail="Invalid business tool type")
-    
-    modified_request = AgentRequest(
-        prompt=prompts[tool_type],
-        model=request.model
-    )
-    return await chat_agent(modified_request)
+    return await generate(business_request(tool_type, request), cacheable=True)
+
+@router.post("/business/{tool_type}/stream")
+async def business_agent_stream(tool_type: str, request: AgentRequest):
+    return stream_agent(business_request(tool_type, request), cacheable=True)
 
 @router.post("/email/{email_type}", response_model=AgentResponse)
 async def email_agent(email_type: str, request: AgentRequest):
-    templates = {
-        "sales": "Write a professional sales email",
-        "welcome": "Write a warm welcome email",
-        "followup": "Write a follow-up email",
-        "apology": "Write a sincere apology email",
-        "newsletter": "Write an engaging newsletter email"
-    }
-    
-    if email_type not in templates:
-        raise HTTPException(status_code=400, detail="Invalid email type")
-    
-    modified_request = AgentRequest(
-        prompt=f"{templates[email_type]} based on: {request.prompt}",
-        model=request.model
-    )
-    return await chat_agent(modified_request)
+    return await generate(email_request(email_type, request), cacheable=True)
+
+@router.post("/email/{email_type}/stream")
+async def email_agent_stream(email_type: str, request: AgentRequest):
+    return stream_agent(email_request(email_type, request), cacheable=True)
 
 @router.post("/social/{platform}", response_model=AgentResponse)
 async def social_agent(platform: str, request: AgentRequest):
-    platforms = {
-        "twitter": "Write a Twitter/X post (max 280 characters)",
-        "linkedin": "Write a professional LinkedIn post",
-        "instagram": "Write an Instagram caption with relevant hashtags",
-        "facebook": "Write a Facebook post",
-        "tiktok": "Write a TikTok video caption with trending hashtags"
-    }
-    
-    if platform not in platforms:
-        raise HTTPException(status_code=400, detail="Invalid platform")
-    
-    modified_request = AgentRequest(
-        prompt=f"{platforms[platform]} about: {request.prompt}",
-        model=request.model
-    )
-    return await chat_agent(modified_request)
+    return await generate(social_request(platform, request), cacheable=True)
+
+@router.post("/social/{platform}/stream")
+async def social_agent_stream(platform: str, request: AgentRequest):
+    return stream_agent(social_request(platform, request), cacheable=True)
 
 @router.post("/blog/post", response_model=AgentResponse)
 async def blog_post_agent(request: AgentRequest):
-    modified_request = AgentRequest(
-        prompt=f"Write a blog post about: {request.prompt}",
-        model=request.model
-    )
-    return await chat_agent(modified_request)
+    return await generate(blog_post_request(request), cacheable=True)
+
+@router.post("/blog/post/stream")
+async def blog_post_agent_stream(request: AgentRequest):
+    return stream_agent(blog_post_request(request), cacheable=True)
 
 @router.post("/blog/outline", response_model=AgentResponse)
 async def blog_outline_agent(request: AgentRequest):
-    modified_request = AgentRequest(
-        prompt=f"Create a detailed blog post outline for: {request.prompt}",
-        model=request.model
-    )
-    return await chat_agent(modified_request)
+    return await generate(blog_outline_request(request), cacheable=True)
+
+@router.post("/blog/outline/stream")
+async def blog_outline_agent_stream(request: AgentRequest):
+    return stream_agent(blog_outline_request(request), cacheable=True)
 
 @router.post("/brand/{brand_type}", response_model=AgentResponse)
 async def brand_agent(brand_type: str, request: AgentRequest):
-    types = {
-        "slogan": "Create a brand slogan",
-        "tagline": "Create a brand tagline",
-        "mission": "Write a brand mission statement",
-        "values": "Define brand values",
-        "story": "Write a brand story"
-    }
-    
-    if brand_type not in types:
-        raise HTTPException(status_code=400, detail="Invalid brand content type")
-    
-    modified_request = AgentRequest(
-        prompt=f"{types[brand_type]} for: {request.prompt}",
-        model=request.model
-    )
-    return await chat_agent(modified_request)
+    return await generate(brand_request(brand_type, request), cacheable=True)
 
+@router.post("/brand/{brand_type}/stream")
+async def brand_agent_stream(brand_type: str, request: AgentRequest):
+    return stream_agent(brand_request(brand_type, request), cacheable=True)
@@ -1,57 +1,495 @@
 # app/routers/analytics.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from datetime import datetime, timedelta
+from sqlalchemy import select, func, cast, distinct, literal, and_, true, BigInteger
+from datetime import date, datetime, timedelta, timezone
+from typing import Literal, Optional
+from zoneinfo import ZoneInfo
+import asyncio
 import uuid
 
-from ..db import get_session
-from ..models import SearchLog, Account, Subscription
+from ..db import get_session, settings, SessionLocal
+from ..cache import StaleWhileRevalidateCache
+from .. import live
+from ..models import SearchLog, SearchResult, Subscription, TenantCounter, SearchRollup, SearchSketch, JobCheckpoint, AccountDailyStat, MrrSnapshot
+from ..rollups import CHECKPOINT as ROLLUP_CHECKPOINT, PENDING_SKETCH_INPUTS, add_to_sketches
+from ..hll import HyperLogLog
+from ..heavy_hitters import top_queries, trending_queries
+from ..olap import REPORTS, run_report
 
 router = APIRouter(prefix="/api/analytics", tags=["analytics"])
 
+# Per-tenant dashboard stats
+dashboard_cache = StaleWhileRevalidateCache(
+    ttl_seconds=settings.DASHBOARD_CACHE_TTL_SECONDS,
+    max_stale_seconds=settings.DASHBOARD_CACHE_MAX_STALE_SECONDS,
+)
+
+def dashboard_query(tenant_id: uuid.UUID):
+    """All dashboard metrics as one statement (one round trip)"""
+    today = func.date_trunc("day", func.now(), settings.ANALYTICS_TIMEZONE)
+    
+    # Totals and MRR from the maintained counters
+    counters = select(
+        func.coalesce(func.sum(TenantCounter.value).filter(TenantCounter.counter == "accounts"), 0)
+            .label("total_businesses"),
+        func.coalesce(func.sum(TenantCounter.value).filter(TenantCounter.counter == "active_subscriptions"), 0)
+            .label("active_subscriptions"),
+        func.coalesce(func.sum(TenantCounter.value).filter(TenantCounter.counter == "mrr_cents"), 0)
+            .label("mrr_cents"),
+    ).where(TenantCounter.tenant_id == tenant_id).subquery()
+    
+    # Searches today: the day rollup plus the few logs the aggregator hasn't reached yet
+    watermark = func.coalesce(
+        select(cast(JobCheckpoint.position, BigInteger))
+        .where(JobCheckpoint.name == ROLLUP_CHECKPOINT).scalar_subquery(),
+        0
+    )
+    rolled_up = select(SearchRollup.searches).where(
+        SearchRollup.tenant_id == tenant_id,
+        SearchRollup.granularity == "day",
+        SearchRollup.bucket == today
+    ).scalar_subquery()
+    pending = select(func.count(SearchLog.id)).where(
+        SearchLog.txid > watermark,
+        SearchLog.tenant_id == tenant_id,
+        SearchLog.created_at >= today
+    ).scalar_subquery()
+    searches_today = func.coalesce(rolled_up, 0) + pending
+    
+    return select(
+        counters.c.total_businesses,
+        counters.c.active_subscriptions,
+        searches_today.label("searches_today"),
+        counters.c.mrr_cents,
+    )
+
+async def compute_dashboard(session: AsyncSession, tenant_id: uuid.UUID) -> dict:
+    row = (await session.execute(dashboard_query(tenant_id))).one()
+    mrr = int(row.mrr_cents)
+    return {
+        "total_businesses": int(row.total_businesses),
+        "active_subscriptions": int(row.active_subscriptions),
+        "searches_today": int(row.searches_today),
+        "mrr_cents": mrr,
+        "mrr_dollars": mrr / 100
+    }
+
 @router.get("/dashboard")
-async def get_dashboard_stats(
+async def get_dashboard_stats():
+    """Get dashboard statistics"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    
+    async def load():
+        # Own session: a background refresh can outlive the request that started it
+        async with SessionLocal() as session:
+            return await compute_dashboard(session, tenant_id)
+    
+    return await dashboard_cache.get(tenant_id, load)
+
+@router.get("/dashboard/stream")
+async def stream_dashboard_stats(request: Request):
+    """Server-Sent Events: a snapshot, then deltas as searches and accounts come in"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    
+    async def load():
+        async with SessionLocal() as session:
+            return await compute_dashboard(session, tenant_id)
+    
+    async def events():
+        # Always a fresh load: a stale cached snapshot would roll back deltas already applied
+        hub = live.get_hub(tenant_id, load)
+        queue = hub.subscribe()
+        try:
+            if hub.state is None:
+                # First viewer on this worker; the snapshot arrives through the queue
+                await hub.ensure_state()
+            else:
+                yield live.frame("snapshot", hub.state)
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield live.frame("snapshot", hub.state) if message is live.RESYNC else message
+        finally:
+            hub.unsubscribe(queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@router.get("/searches/daily")
+async def get_daily_search_stats(
+    days: int = Query(7, ge=1, le=366),
     session: AsyncSession = Depends(get_session)
 ):
-    """Get dashboard statistics"""
+    """Daily search totals from the rollups, most recent first"""
     tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
     
-    # Total businesses
-    total_businesses = await session.scalar(
-        select(func.count(Account.id)).where(Account.tenant_id == tenant_id)
-    )
+    query = select(SearchRollup).where(
+        SearchRollup.tenant_id == tenant_id,
+        SearchRollup.granularity == "day"
+    ).order_by(SearchRollup.bucket.desc()).limit(days)
+    result = await session.execute(query)
     
-    # Active subscriptions
-    active_subs = await session.scalar(
-        select(func.count(Subscription.id)).where(
-            Subscription.tenant_id == tenant_id,
-            Subscription.status == 'active'
-        )
-    )
+    return [
+        {
+            "day": r.bucket.isoformat(),
+            "searches": r.searches,
+            "zero_results": r.zero_results,
+            "zero_result_rate": r.zero_results / r.searches if r.searches else 0.0,
+            "unique_queries": r.unique_queries,
+        }
+        for r in result.scalars().all()
+    ]
+
+# Time series tiers: raw logs for minutes, rollups for hours and days
+MAX_BUCKETS = 5000
+STEPS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1)}
+
+def pick_granularity(span: timedelta) -> str:
+    if span <= timedelta(hours=6):
+        return "minute"
+    if span <= timedelta(days=7):
+        return "hour"
+    return "day"
+
+def bucket_starts(start: datetime, end: datetime, granularity: str, tz: ZoneInfo):
+    """Every bucket start in [start, end), matching date_trunc in SQL"""
+    if granularity == "day":
+        # Walk local dates so DST days stay one bucket each
+        day = start.astimezone(tz).date()
+        while True:
+            bucket = datetime(day.year, day.month, day.day, tzinfo=tz)
+            if bucket >= end:
+                return
+            yield bucket
+            day += timedelta(days=1)
+    step = STEPS[granularity]
+    # Truncate in UTC like SQL does; in the caller's offset a +05:30 start
+    # would land between buckets and never match
+    bucket = start.astimezone(timezone.utc).replace(second=0, microsecond=0)
+    if granularity == "hour":
+        bucket = bucket.replace(minute=0)
+    while bucket < end:
+        yield bucket
+        bucket += step
+
+def bucket_expr(granularity: str):
+    if granularity == "day":
+        return func.date_trunc("day", SearchLog.created_at, settings.ANALYTICS_TIMEZONE)
+    return func.date_trunc(granularity, SearchLog.created_at, "UTC")
+
+@router.get("/searches/timeseries")
+async def get_search_timeseries(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: Optional[Literal["minute", "hour", "day"]] = None,
+    session: AsyncSession = Depends(get_session)
+):
+    """Search counts per time bucket, with empty buckets filled in"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    tz = ZoneInfo(settings.ANALYTICS_TIMEZONE)
     
-    # Searches today
-    today_searches = await session.scalar(
-        select(func.count(SearchLog.id)).where(
+    # Naive datetimes are taken as UTC
+    end = end or datetime.now(timezone.utc)
+    end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    start = start or end - timedelta(hours=24)
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    granularity = granularity or pick_granularity(end - start)
+    buckets = []
+    for bucket in bucket_starts(start, end, granularity, tz):
+        buckets.append(bucket)
+        if len(buckets) > MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"Range too large for {granularity} buckets")
+    
+    counts = {}
+    if granularity == "minute":
+        # Short ranges straight off ix_search_logs_tenant_created
+        bucket = bucket_expr("minute").label("bucket")
+        query = select(
+            bucket,
+            func.count(SearchLog.id),
+            func.count(SearchLog.id).filter(SearchLog.result_count == 0),
+        ).where(
             SearchLog.tenant_id == tenant_id,
-            SearchLog.created_at >= datetime.now().replace(hour=0, minute=0)
+            SearchLog.created_at >= buckets[0],
+            SearchLog.created_at < end
+        ).group_by(bucket)
+        rows = (await session.execute(query)).all()
+    else:
+        # Rollups, plus logs past the aggregator watermark bucketed the same way
+        rolled_up = select(
+            SearchRollup.bucket, SearchRollup.searches, SearchRollup.zero_results
+        ).where(
+            SearchRollup.tenant_id == tenant_id,
+            SearchRollup.granularity == granularity,
+            SearchRollup.bucket >= buckets[0],
+            SearchRollup.bucket < end
         )
-    )
+        watermark = func.coalesce(
+            select(cast(JobCheckpoint.position, BigInteger))
+            .where(JobCheckpoint.name == ROLLUP_CHECKPOINT).scalar_subquery(),
+            0
+        )
+        bucket = bucket_expr(granularity).label("bucket")
+        pending = select(
+            bucket,
+            func.count(SearchLog.id),
+            func.count(SearchLog.id).filter(SearchLog.result_count == 0),
+        ).where(
+            SearchLog.txid > watermark,
+            SearchLog.tenant_id == tenant_id,
+            SearchLog.created_at >= buckets[0],
+            SearchLog.created_at < end
+        ).group_by(bucket)
+        rows = (await session.execute(rolled_up.union_all(pending))).all()
+    
+    for bucket, searches, zero_results in rows:
+        total = counts.setdefault(bucket, [0, 0])
+        total[0] += searches
+        total[1] += zero_results
     
-    # MRR calculation
-    mrr = await session.scalar(
-        select(func.sum(Subscription.amount_cents)).where(
-            Subscription.tenant_id == tenant_id,
-            Subscription.status == 'active'
+    return {
+        "granularity": granularity,
+        "start": buckets[0].isoformat() if buckets else start.isoformat(),
+        "end": end.isoformat(),
+        "points": [
+            {
+                "bucket": bucket.isoformat(),
+                "searches": counts.get(bucket, (0, 0))[0],
+                "zero_results": counts.get(bucket, (0, 0))[1],
+            }
+            for bucket in buckets
+        ],
+    }
+
+# Most not-yet-aggregated logs /searches/unique folds in per request
+MAX_PENDING_LOGS = 50000
+
+@router.get("/searches/unique")
+async def get_unique_search_counts(
+    start: date = Query(..., description="First day, inclusive"),
+    end: Optional[date] = Query(None, description="Last day, inclusive; defaults to start"),
+    session: AsyncSession = Depends(get_session)
+):
+    """Approximate unique searchers and queries over a day range, from merged sketches"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    tz = ZoneInfo(settings.ANALYTICS_TIMEZONE)
+    end = end or start
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    first = datetime(start.year, start.month, start.day, tzinfo=tz)
+    last = datetime(end.year, end.month, end.day, tzinfo=tz)
+    
+    searchers, queries = HyperLogLog(), HyperLogLog()
+    sketches = await session.execute(
+        select(SearchSketch.searchers, SearchSketch.queries).where(
+            SearchSketch.tenant_id == tenant_id,
+            SearchSketch.day >= first,
+            SearchSketch.day <= last
         )
-    ) or 0
+    )
+    for day_searchers, day_queries in sketches.all():
+        searchers.merge(HyperLogLog.from_bytes(day_searchers))
+        queries.merge(HyperLogLog.from_bytes(day_queries))
+    
+    # Fold in this range's logs the aggregator hasn't reached yet; capped, since
+    # the backlog is only large when the aggregator is stalled
+    watermark = await session.scalar(
+        select(JobCheckpoint.position).where(JobCheckpoint.name == ROLLUP_CHECKPOINT)
+    )
+    pending = {}
+    rows = await session.execute(PENDING_SKETCH_INPUTS, {
+        "lo": int(watermark or 0),
+        "tenant": tenant_id,
+        "since": first,
+        "until": last + timedelta(days=1),
+        "limit": MAX_PENDING_LOGS,
+        "tz": settings.ANALYTICS_TIMEZONE,
+    })
+    add_to_sketches(pending, rows.all())
+    for day_searchers, day_queries in pending.values():
+        searchers.merge(day_searchers)
+        queries.merge(day_queries)
     
     return {
-        "total_businesses": total_businesses,
-        "active_subscriptions": active_subs,
-        "searches_today": today_searches,
-        "mrr_cents": mrr,
-        "mrr_dollars": mrr / 100
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "unique_searchers": searchers.count(),
+        "unique_queries": queries.count(),
+        "relative_error": round(searchers.relative_error, 4),
+    }
+
+@router.get("/searches/top")
+async def get_top_searches(
+    k: int = Query(10, ge=1, le=100),
+    session: AsyncSession = Depends(get_session)
+):
+    """Most popular queries (recent searches weigh more), from the heavy-hitter sketches"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    return await top_queries(session, tenant_id, k)
+
+@router.get("/searches/trending")
+async def get_trending_searches(
+    k: int = Query(10, ge=1, le=100),
+    session: AsyncSession = Depends(get_session)
+):
+    """Queries growing fastest versus the previous window"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    return await trending_queries(session, tenant_id, k)
+
+@router.get("/reports/{report}")
+async def get_report(
+    report: str,
+    start: Optional[date] = Query(None, description="First day, inclusive; defaults to 30 days before end"),
+    end: Optional[date] = Query(None, description="Last day, inclusive; defaults to yesterday"),
+    engine: Literal["auto", "olap", "sql"] = "auto",
+    window_days: int = Query(7, ge=1, le=90, description="search_funnel: days after a search a subscription still counts"),
+    session: AsyncSession = Depends(get_session)
+):
+    """Aggregate report over exported files (DuckDB) or Postgres when the export is behind"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    if report not in REPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown report; available: {', '.join(REPORTS)}")
+    end = end or datetime.now(ZoneInfo(settings.ANALYTICS_TIMEZONE)).date() - timedelta(days=1)
+    start = start or end - timedelta(days=29)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    
+    try:
+        return await run_report(session, report, tenant_id, start, end, engine, window_days)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/funnel")
+async def get_search_funnel(
+    start: Optional[date] = Query(None, description="First day, inclusive; defaults to 30 days before end"),
+    end: Optional[date] = Query(None, description="Last day, inclusive; defaults to today"),
+    window_days: int = Query(7, ge=1, le=90, description="Days after a search a subscription still counts"),
+    session: AsyncSession = Depends(get_session)
+):
+    """Search -> click -> subscription conversion funnel"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    tz = ZoneInfo(settings.ANALYTICS_TIMEZONE)
+    end = end or datetime.now(tz).date()
+    start = start or end - timedelta(days=29)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    after = end + timedelta(days=1)
+    
+    # First subscription to the clicked account within the window, if any
+    converted = select(literal(1).label("hit")).where(
+        Subscription.account_id == SearchResult.account_id,
+        Subscription.tenant_id == SearchLog.tenant_id,
+        Subscription.created_at >= SearchLog.created_at,
+        Subscription.created_at < SearchLog.created_at + timedelta(days=window_days)
+    ).limit(1).lateral("converted")
+    
+    # One pass: tenant/created_at range on logs, partial index to clicked
+    # results, then an index probe per click into subscriptions
+    query = select(
+        func.count(distinct(SearchLog.id)).label("searches"),
+        func.count(distinct(SearchLog.id)).filter(SearchResult.id.isnot(None)).label("searches_with_click"),
+        func.count(SearchResult.id).label("clicks"),
+        func.count(distinct(SearchResult.account_id)).label("clicked_accounts"),
+        func.count(distinct(SearchResult.account_id)).filter(converted.c.hit.isnot(None)).label("converted_accounts"),
+    ).select_from(SearchLog).outerjoin(
+        SearchResult, and_(SearchResult.search_log_id == SearchLog.id, SearchResult.was_clicked)
+    ).outerjoin(converted, true()).where(
+        SearchLog.tenant_id == tenant_id,
+        SearchLog.created_at >= datetime(start.year, start.month, start.day, tzinfo=tz),
+        SearchLog.created_at < datetime(after.year, after.month, after.day, tzinfo=tz)
+    )
+    row = (await session.execute(query)).one()
+    
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "window_days": window_days,
+        "searches": row.searches,
+        "searches_with_click": row.searches_with_click,
+        "clicks": row.clicks,
+        "clicked_accounts": row.clicked_accounts,
+        "converted_accounts": row.converted_accounts,
+        "click_through_rate": row.searches_with_click / row.searches if row.searches else 0.0,
+        "conversion_rate": row.converted_accounts / row.clicked_accounts if row.clicked_accounts else 0.0,
+    }
+
+@router.get("/accounts/{account_id}/impressions")
+async def get_account_impressions(
+    account_id: uuid.UUID,
+    start: Optional[date] = Query(None, description="First day, inclusive; defaults to 29 days before end"),
+    end: Optional[date] = Query(None, description="Last day, inclusive; defaults to today"),
+    session: AsyncSession = Depends(get_session)
+):
+    """Daily impressions, clicks and average position for one account, from account_daily_stats"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    tz = ZoneInfo(settings.ANALYTICS_TIMEZONE)
+    end = end or datetime.now(tz).date()
+    start = start or end - timedelta(days=29)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    
+    # Primary key range: (tenant, account, day)
+    query = select(AccountDailyStat).where(
+        AccountDailyStat.tenant_id == tenant_id,
+        AccountDailyStat.account_id == account_id,
+        AccountDailyStat.day >= datetime(start.year, start.month, start.day, tzinfo=tz),
+        AccountDailyStat.day <= datetime(end.year, end.month, end.day, tzinfo=tz)
+    ).order_by(AccountDailyStat.day)
+    days = (await session.execute(query)).scalars().all()
+    
+    impressions = sum(d.impressions for d in days)
+    clicks = sum(d.clicks for d in days)
+    position_sum = sum(d.position_sum for d in days)
+    return {
+        "account_id": str(account_id),
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "impressions": impressions,
+        "clicks": clicks,
+        "click_through_rate": clicks / impressions if impressions else 0.0,
+        "average_position": position_sum / impressions if impressions else None,
+        "days": [
+            {
+                "day": d.day.isoformat(),
+                "impressions": d.impressions,
+                "clicks": d.clicks,
+                "click_through_rate": d.clicks / d.impressions if d.impressions else 0.0,
+                "average_position": d.position_sum / d.impressions if d.impressions else None,
+            }
+            for d in days
+        ],
     }
 
-    
\ No newline at end of file
+@router.get("/mrr/history")
+async def get_mrr_history(
+    days: int = Query(90, ge=1, le=1830),
+    session: AsyncSession = Depends(get_session)
+):
+    """Daily MRR, active subscriptions and churn from the snapshots, oldest first"""
+    tenant_id = uuid.UUID("11111111-1111-1111-1111-111111111111")
+    
+    # One extra day so the first row has something to diff against
+    query = select(MrrSnapshot).where(
+        MrrSnapshot.tenant_id == tenant_id
+    ).order_by(MrrSnapshot.day.desc()).limit(days + 1)
+    snapshots = list(reversed((await session.execute(query)).scalars().all()))
+    
+    history = []
+    for previous, s in zip([None] + snapshots, snapshots):
+        history.append({
+            "day": s.day.isoformat(),
+            "mrr_cents": s.mrr_cents,
+            "mrr_dollars": s.mrr_cents / 100,
+            "active_subscriptions": s.active_subscriptions,
+            "mrr_change_cents": s.mrr_cents - previous.mrr_cents if previous else None,
+            "active_change": s.active_subscriptions - previous.active_subscriptions if previous else None,
+            "churned_subscriptions": s.churned_subscriptions - previous.churned_subscriptions if previous else None,
+        })
+    return history[-days:]
@@ -6,17 +6,44 @@ from typing import Optional
 import uuid
 
 from ..db import get_session
+from ..fieldsets import parse_fields
+from ..heavy_hitters import record_search
+from .. import live
 from ..models import Account, SearchLog, SearchResult
 
 router = APIRouter(prefix="/api/search", tags=["search"])
 
+# Result fields: the columns each one needs and how it is rendered
+RESULT_FIELDS = {
+    "id": ([], lambda b: str(b.id)),
+    "name": ([Account.company_name], lambda b: b.company_name or "Unknown"),
+    "description": ([Account.description], lambda b: b.description),
+    "address": (
+        [Account.bus_address_1, Account.bus_city, Account.bus_state],
+        lambda b: f"{b.bus_address_1}, {b.bus_city}, {b.bus_state}" if b.bus_address_1 else None,
+    ),
+    "phone": ([Account.phone], lambda b: b.phone),
+    "website": ([Account.website], lambda b: b.website),
+    "lat": ([Account.lat], lambda b: float(b.lat) if b.lat else None),
+    "lng": ([Account.lng], lambda b: float(b.lng) if b.lng else None),
+    "attributes": ([Account.attributes], lambda b: b.attributes or {}),
+}
+
 @router.get("/")
 async def search_businesses(
     q: str = Query(..., description="Search query"),
     limit: int = Query(20, le=100),
+    fields: Optional[str] = Query(None, description="Comma-separated result fields"),
     session: AsyncSession = Depends(get_session)
 ):
     """Search for businesses by name, description, or attributes"""
+    selected = parse_fields(fields, RESULT_FIELDS) or list(RESULT_FIELDS)
+    
+    # Project only the columns the requested fields need (id is always needed)
+    columns = {Account.id.key: Account.id}
+    for name in selected:
+        for column in RESULT_FIELDS[name][0]:
+            columns[column.key] = column
     
     # Log the search
     search_log = SearchLog(
@@ -28,7 +55,7 @@ async def search_businesses(
     
     # Build search query
     search_term = f"%{q}%"
-    query = select(Account).where(
+    query = select(*columns.values()).where(
         Account.tenant_id == uuid.UUID("11111111-1111-1111-1111-111111111111")
     ).where(
         or_(
@@ -40,7 +67,7 @@ async def search_businesses(
     
     # Execute search
     result = await session.execute(query)
-    businesses = result.scalars().all()
+    businesses = result.all()
     
     # Update search log
     search_log.result_count = len(businesses)
@@ -56,23 +83,15 @@ async def search_businesses(
         session.add(search_result)
     
     await session.commit()
+    record_search(search_log.tenant_id, q)
+    live.record(search_log.tenant_id, "searches_today")
     
     return {
         "search_id": str(search_log.id),
         "query": q,
         "result_count": len(businesses),
         "results": [
-            {
-                "id": str(business.id),
-                "name": business.company_name or "Unknown",
-                "description": business.description,
-                "address": f"{business.bus_address_1}, {business.bus_city}, {business.bus_state}" if business.bus_address_1 else None,
-                "phone": business.phone,
-                "website": business.website,
-                "lat": float(business.lat) if business.lat else None,
-                "lng": float(business.lng) if business.lng else None,
-                "attributes": business.attributes or {}
-            }
+            {name: RESULT_FIELDS[name][1](business) for name in selected}
             for business in businesses
         ]
     }
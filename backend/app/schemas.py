@@ -60,11 +60,29 @@ class AccountUpdate(BaseModel):
 class AccountResponse(AccountBase):
     id: uuid.UUID
     tenant_id: uuid.UUID
-    created_at: Optional[datetime]
+    created_at: Optional[datetime] = None
+    version: Optional[int] = None
     
     class Config:
         from_attributes = True
 
+class AccountBatchRequest(BaseModel):
+    ids: List[uuid.UUID] = Field(..., min_length=1, max_length=500)
+
+class AccountBatchResponse(BaseModel):
+    # One entry per requested id, in request order; None marks a miss
+    results: List[Optional[AccountResponse]]
+    missing: List[uuid.UUID]
+
+class AccountUpsertRequest(BaseModel):
+    # Keyed on (tenant_id, email_address); later duplicates in a request win
+    accounts: List[AccountCreate] = Field(..., min_length=1, max_length=5000)
+
+class AccountUpsertResponse(BaseModel):
+    inserted: int
+    updated: int
+    unchanged: int
+
 # Category schemas
 class CategoryResponse(BaseModel):
     id: uuid.UUID
@@ -0,0 +1,100 @@
+# benchmarks/bench_account_writes.py
+# Compares the old ORM create/update path (INSERT/SELECT + commit + refresh)
+# with the INSERT/UPDATE ... RETURNING path used by app/routers/accounts.py.
+#
+# Needs the database from app/db.py settings. Run from backend/:
+#   python -m benchmarks.bench_account_writes [iterations]
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+
+from sqlalchemy import event, select, insert, update, delete
+
+from app.db import engine, SessionLocal
+from app.models import Account
+from app.schemas import AccountResponse
+
+TENANT_ID = uuid.UUID("11111111-1111-1111-1111-111111111111")
+
+statement_count = 0
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    global statement_count
+    statement_count += 1
+
+def _payload(i):
+    return {
+        "email_address": f"bench-{i}-{uuid.uuid4().hex}@example.com",
+        "company_name": f"Bench Co {i}",
+        "description": "benchmark row",
+    }
+
+async def orm_create(i):
+    async with SessionLocal() as session:
+        account = Account(tenant_id=TENANT_ID, **_payload(i))
+        session.add(account)
+        await session.commit()
+        await session.refresh(account)
+        return account.id
+
+async def orm_update(account_id, i):
+    async with SessionLocal() as session:
+        result = await session.execute(select(Account).where(Account.id == account_id))
+        account = result.scalar_one()
+        account.description = f"orm update {i}"
+        await session.commit()
+        await session.refresh(account)
+
+async def returning_create(i):
+    async with SessionLocal() as session:
+        stmt = insert(Account).values(
+            tenant_id=TENANT_ID, **_payload(i)
+        ).returning(*Account.__table__.c)
+        row = (await session.execute(stmt)).one()
+        await session.commit()
+        return AccountResponse.model_validate(row).id
+
+async def returning_update(account_id, i):
+    async with SessionLocal() as session:
+        stmt = update(Account).where(
+            Account.id == account_id
+        ).values(description=f"returning update {i}").returning(*Account.__table__.c)
+        row = (await session.execute(stmt)).one()
+        await session.commit()
+        AccountResponse.model_validate(row)
+
+async def run(name, create, update_fn, iterations):
+    global statement_count
+    ids = []
+    timings = []
+    statement_count = 0
+    for i in range(iterations):
+        start = time.perf_counter()
+        account_id = await create(i)
+        await update_fn(account_id, i)
+        timings.append((time.perf_counter() - start) * 1000)
+        ids.append(account_id)
+    print(
+        f"{name:<10} create+update  "
+        f"statements/op={statement_count / iterations:.1f}  "
+        f"p50={statistics.median(timings):.2f}ms  "
+        f"mean={statistics.mean(timings):.2f}ms"
+    )
+    return ids
+
+async def main(iterations):
+    created = []
+    try:
+        created += await run("orm", orm_create, orm_update, iterations)
+        created += await run("returning", returning_create, returning_update, iterations)
+    finally:
+        async with SessionLocal() as session:
+            await session.execute(delete(Account).where(Account.id.in_(created)))
+            await session.commit()
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
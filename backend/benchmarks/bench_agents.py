@@ -0,0 +1,100 @@
+# benchmarks/bench_agents.py
+# Load test: how much do in-flight LLM calls delay unrelated requests?
+#
+# Starts a fake OpenAI-compatible upstream that answers after a fixed delay,
+# fires concurrent /agents/chat requests, and meanwhile times /ping. Compares
+# the old synchronous client (blocks the event loop) with the async client
+# used by app/routers/agents.py. No database or API key needed. Run from backend/:
+#   python -m benchmarks.bench_agents [concurrent_chats] [upstream_delay_seconds]
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+PORT = 8799
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{PORT}/v1"
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from openai import OpenAI
+
+from app.routers import agents
+
+DELAY = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+upstream = FastAPI()
+
+@upstream.post("/v1/chat/completions")
+async def fake_completion(body: dict):
+    await asyncio.sleep(DELAY)
+    return {
+        "id": "bench", "object": "chat.completion", "created": 0, "model": body["model"],
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": "ok"}}],
+    }
+
+def start_upstream():
+    server = uvicorn.Server(uvicorn.Config(upstream, host="127.0.0.1", port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+app = FastAPI()
+app.include_router(agents.router)
+
+@app.get("/ping")
+async def ping():
+    return {"ok": True}
+
+# The previous implementation: sync client called from async code
+sync_client = OpenAI()
+
+@app.post("/blocking/chat")
+async def blocking_chat(request: agents.AgentRequest):
+    response = sync_client.chat.completions.create(
+        model=request.model, messages=[{"role": "user", "content": request.prompt}],
+        max_tokens=1000, temperature=0.7
+    )
+    return {"content": response.choices[0].message.content, "model": request.model}
+
+async def run(name, path, chats):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        done = asyncio.Event()
+        pings = []
+
+        async def probe():
+            # A ping is due every 20ms; measure from when it was due, so time
+            # spent waiting for a blocked event loop counts
+            due = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get("/ping")
+                now = time.perf_counter()
+                pings.append((now - due) * 1000)
+                due = max(due + 0.02, now)
+
+        prober = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            client.post(path, json={"prompt": f"hello {i}"}) for i in range(chats)
+        ])
+        elapsed = time.perf_counter() - start
+        done.set()
+        await prober
+
+    print(
+        f"{name:<9} {chats} chats in {elapsed:.2f}s  "
+        f"ping p50={statistics.median(pings):.1f}ms  max={max(pings):.1f}ms  samples={len(pings)}"
+    )
+
+async def main(chats):
+    await run("blocking", "/blocking/chat", chats)
+    await run("async", "/agents/chat", chats)
+
+if __name__ == "__main__":
+    start_upstream()
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
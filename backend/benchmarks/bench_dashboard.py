@@ -0,0 +1,57 @@
+# benchmarks/bench_dashboard.py
+# Compares the original four sequential dashboard queries with the single
+# statement built by app.routers.analytics.dashboard_query.
+#
+# Needs the database from app/db.py settings. Run from backend/:
+#   python -m benchmarks.bench_dashboard [iterations]
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select, func
+
+from app.db import engine, SessionLocal
+from app.models import Account, SearchLog, Subscription
+from app.routers.analytics import compute_dashboard
+
+TENANT_ID = uuid.UUID("11111111-1111-1111-1111-111111111111")
+
+async def sequential(session):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    await session.scalar(select(func.count(Account.id)).where(Account.tenant_id == TENANT_ID))
+    await session.scalar(select(func.count(Subscription.id)).where(
+        Subscription.tenant_id == TENANT_ID, Subscription.status == 'active'))
+    await session.scalar(select(func.count(SearchLog.id)).where(
+        SearchLog.tenant_id == TENANT_ID, SearchLog.created_at >= today))
+    await session.scalar(select(func.sum(Subscription.amount_cents)).where(
+        Subscription.tenant_id == TENANT_ID, Subscription.status == 'active'))
+
+async def single(session):
+    await compute_dashboard(session, TENANT_ID)
+
+async def run(name, fn, iterations):
+    timings = []
+    async with SessionLocal() as session:
+        await fn(session)  # warm up the connection
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await fn(session)
+            timings.append((time.perf_counter() - start) * 1000)
+    print(
+        f"{name:<11} p50={statistics.median(timings):.2f}ms  "
+        f"p95={sorted(timings)[int(len(timings) * 0.95)]:.2f}ms  "
+        f"mean={statistics.mean(timings):.2f}ms"
+    )
+
+async def main(iterations):
+    try:
+        await run("sequential", sequential, iterations)
+        await run("single", single, iterations)
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
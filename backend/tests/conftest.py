@@ -0,0 +1,6 @@
+# tests/conftest.py
+# Puts backend/ on sys.path so plain `pytest` finds the app package from any directory
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
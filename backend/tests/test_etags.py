@@ -0,0 +1,24 @@
+# tests/test_etags.py
+from app.routers.accounts import account_etag, etag_matches, if_match_versions
+
+def test_account_etag():
+    assert account_etag(3) == '"3"'
+    assert account_etag(3, ["id", "company_name"]) == '"3;id,company_name"'
+
+def test_if_none_match():
+    assert not etag_matches(None, '"3"')
+    assert not etag_matches("", '"3"')
+    assert etag_matches("*", '"3"')
+    assert etag_matches('"3"', '"3"')
+    assert not etag_matches('"4"', '"3"')
+    # Weak comparison, any tag in the list
+    assert etag_matches('"1", W/"3"', '"3"')
+    # A sparse representation doesn't match the full one
+    assert not etag_matches('"3"', account_etag(3, ["id"]))
+
+def test_if_match_versions():
+    assert if_match_versions("*") is None
+    assert if_match_versions(' "3" ') == [3]
+    assert if_match_versions('"3", "5"') == [3, 5]
+    # Strong comparison: weak tags, sparse tags and junk never match
+    assert if_match_versions('W/"3", "3;id", "x", 7') == []
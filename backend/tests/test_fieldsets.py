@@ -0,0 +1,29 @@
+# tests/test_fieldsets.py
+import pytest
+from fastapi import HTTPException
+
+from app.fieldsets import parse_fields, to_json
+
+ALLOWED = {"id", "company_name", "bus_city"}
+
+def test_no_fields_means_everything():
+    assert parse_fields(None, ALLOWED) is None
+
+def test_order_kept_and_duplicates_dropped():
+    assert parse_fields(" bus_city,id ,bus_city", ALLOWED) == ["bus_city", "id"]
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(HTTPException) as excinfo:
+        parse_fields("id,password,secret", ALLOWED)
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == "Unknown fields: password, secret"
+
+@pytest.mark.parametrize("fields", ["", " , ,"])
+def test_empty_selection_is_rejected(fields):
+    with pytest.raises(HTTPException) as excinfo:
+        parse_fields(fields, ALLOWED)
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == "No fields requested"
+
+def test_to_json_is_compact():
+    assert to_json({"id": 1, "bus_city": None}) == b'{"id":1,"bus_city":null}'
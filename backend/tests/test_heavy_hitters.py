@@ -0,0 +1,59 @@
+# tests/test_heavy_hitters.py
+import random
+
+from app.heavy_hitters import SpaceSaving, normalize_query
+
+def test_counts_are_exact_below_capacity():
+    sketch = SpaceSaving(capacity=3)
+    for item in ["a", "b", "a", "c", "a", "b"]:
+        sketch.add(item)
+    assert sketch.top(3) == [("a", 3, 0), ("b", 2, 0), ("c", 1, 0)]
+
+def test_eviction_replaces_the_smallest_counter():
+    sketch = SpaceSaving(capacity=2)
+    for item in ["a", "a", "a", "b", "b", "c"]:
+        sketch.add(item)
+    # c took over b's counter: count overestimates by at most the inherited error
+    assert "b" not in sketch.counts
+    assert sketch.counts["c"] == [3, 2]
+    assert sketch.estimate("a") == 3
+    assert sketch.estimate("b") == 0
+
+def test_frequent_items_survive_a_long_tail():
+    rng = random.Random(42)
+    stream = ["hot"] * 300 + ["warm"] * 150 + [f"rare{i}" for i in range(1000)]
+    rng.shuffle(stream)
+    sketch = SpaceSaving(capacity=20)
+    for item in stream:
+        sketch.add(item)
+    top = sketch.top(2)
+    assert [item for item, _, _ in top] == ["hot", "warm"]
+    for item, count, error in top:
+        true = stream.count(item)
+        assert count - error <= true <= count
+
+def test_merge_adds_counts_and_keeps_capacity():
+    left, right = SpaceSaving(capacity=2), SpaceSaving(capacity=2)
+    for item in ["a", "a", "b"]:
+        left.add(item)
+    for item in ["a", "c", "c", "c"]:
+        right.add(item)
+    left.merge(right, factor=0.5)
+    assert len(left.counts) == 2
+    assert left.top(2) == [("a", 2.5, 0), ("c", 1.5, 0)]
+
+def test_scale_and_round_trip():
+    sketch = SpaceSaving(capacity=4)
+    for item in ["a", "a", "b"]:
+        sketch.add(item)
+    sketch.scale(0.5)
+    restored = SpaceSaving.from_list(4, sketch.to_list())
+    assert restored.top(2) == [("a", 1, 0), ("b", 0.5, 0)]
+    # The rebuilt heap still evicts the smallest
+    restored.add("c")
+    restored.add("d")
+    restored.add("e")
+    assert "b" not in restored.counts
+
+def test_normalize_query():
+    assert normalize_query("  Pizza Place ") == "pizza place"
@@ -0,0 +1,44 @@
+# tests/test_hll.py
+import pytest
+
+from app.hll import HyperLogLog
+
+def test_empty_and_duplicates():
+    sketch = HyperLogLog()
+    assert sketch.count() == 0
+    for _ in range(100):
+        sketch.add("same")
+    assert sketch.count() == 1
+
+@pytest.mark.parametrize("n", [1000, 50000])
+def test_estimate_within_error_bound(n):
+    sketch = HyperLogLog()
+    for i in range(n):
+        sketch.add(f"user-{i}")
+    # Three standard errors
+    assert abs(sketch.count() - n) <= 3 * sketch.relative_error * n
+
+def test_merge_counts_the_union():
+    left, right, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        left.add(i)
+        both.add(i)
+    for i in range(10000, 30000):
+        right.add(i)
+        both.add(i)
+    left.merge(right)
+    # Register-wise max is exactly the sketch of the union
+    assert left.registers == both.registers
+    assert abs(left.count() - 30000) <= 3 * left.relative_error * 30000
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(precision=12).merge(HyperLogLog(precision=10))
+
+def test_bytes_round_trip():
+    sketch = HyperLogLog(precision=10)
+    for i in range(500):
+        sketch.add(i)
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored.p == 10
+    assert restored.count() == sketch.count()